@@ -52,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'popup_field.middleware.PopupRequestMiddleware',
 ]
 
 ROOT_URLCONF = 'demo.urls'
@@ -124,3 +125,4 @@ STATICFILES_DIRS = ()
 
 POPUP_TEMPLATE_NAME_CREATE = 'popup/create.html'
 POPUP_TEMPLATE_NAME_UPDATE = 'popup/update.html'
+POPUP_COMPLETION_MODE = 'message'
@@ -1,10 +1,11 @@
 from django.contrib import admin
+from popup_field.admin import PopupAdminMixin
 from .models import *
 
 
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(PopupAdminMixin, admin.ModelAdmin):
     list_display = ('id', 'title', 'category')
-    filter_horizontal = ('tags',)
+    list_editable = ('category',)
 
 
 class CategoryAdmin(admin.ModelAdmin):
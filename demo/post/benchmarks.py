@@ -0,0 +1,200 @@
+"""
+Benchmarks of popup widgets rendering and popup CRUD views, run them with:
+
+    python manage.py popup_benchmark --sizes 1000,100000 --output bench.json
+    python manage.py popup_benchmark --sizes 1000,100000 --baseline bench.json
+"""
+import json
+import statistics
+import time
+
+from django import forms
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.forms import formset_factory
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from .models import Category, Tag, Post
+from .popups import CategoryPopupCRUDViewSet, TagPopupCRUDViewSet
+
+# widget arguments of each render mode
+MODES = {
+    'full': {},
+    'selected_only': {'selected_only': True},
+    'remote': {'remote': True},
+    'shared': {'shared_choices': True},
+    'fast': {'fast_render': True},
+}
+
+
+def ensure_tables():
+    """
+    The demo ships without migrations, create the tables of post app if they are missing
+    """
+    tables = connection.introspection.table_names()
+    with connection.schema_editor() as editor:
+        for model in (Category, Tag, Post):
+            if model._meta.db_table not in tables:
+                editor.create_model(model)
+
+
+def populate(size, batch_size=10000):
+    """
+    Fill Category and Tag with exactly size rows
+    """
+    for model in (Category, Tag):
+        count = model.objects.count()
+        if count > size:
+            model.objects.all().delete()
+            count = 0
+        while count < size:
+            batch = min(batch_size, size - count)
+            model.objects.bulk_create([model(name='{} {}'.format(model.__name__, count + i)) for i in range(batch)])
+            count += batch
+
+
+def make_request(method='get', path='/', data=None, **extra):
+    request = getattr(RequestFactory(), method)(path, data or {}, **extra)
+    request.user = AnonymousUser()
+    request._dont_enforce_csrf_checks = True
+    return request
+
+
+def make_form_class(mode):
+    class BenchmarkPostForm(forms.ModelForm):
+        class Meta:
+            model = Post
+            fields = ['category', 'tags']
+            widgets = {
+                'category': CategoryPopupCRUDViewSet.get_fk_popup_field(**MODES[mode]),
+                'tags': TagPopupCRUDViewSet.get_m2m_popup_field(**MODES[mode]),
+            }
+
+    return BenchmarkPostForm
+
+
+def measure(func, repeat):
+    """
+    Return the median seconds, the bytes of the output and the number of queries of func
+    """
+    timings = []
+    output, queries = '', 0
+    for i in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            output = func()
+            timings.append(time.perf_counter() - start)
+        queries = len(context.captured_queries)
+    return {
+        'seconds': statistics.median(timings),
+        'bytes': len(output.encode('utf-8')) if isinstance(output, str) else 0,
+        'queries': queries,
+    }
+
+
+def bench_widgets(size, modes, repeat):
+    results = {}
+    request = make_request()
+    category = Category.objects.order_by('pk').first()
+    tags = list(Tag.objects.order_by('pk').values_list('pk', flat=True)[:3])
+    for mode in modes:
+        form_class = make_form_class(mode)
+
+        def render():
+            form = form_class(initial={'category': category.pk, 'tags': tags})
+            for name in ('category', 'tags'):
+                form.fields[name].widget.request = request
+            return str(form['category']) + str(form['tags'])
+
+        results['render/{}/rows={}'.format(mode, size)] = measure(render, repeat)
+    return results
+
+
+def bench_formsets(counts, modes, repeat):
+    results = {}
+    for mode in modes:
+        formset_class = formset_factory(make_form_class(mode), extra=0)
+        for count in counts:
+            request = make_request()
+
+            def render():
+                formset = formset_class(initial=[{} for i in range(count)])
+                formset.extra = count
+                for form in formset:
+                    for name in ('category', 'tags'):
+                        form.fields[name].widget.request = request
+                return str(formset)
+
+            results['formset/{}/widgets={}'.format(mode, count * 2)] = measure(render, repeat)
+    return results
+
+
+def bench_views(requests):
+    results = {}
+    viewset = CategoryPopupCRUDViewSet
+    create, update, delete = viewset.get_view('create'), viewset.get_view('update'), viewset.get_view('delete')
+    ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+    created = []
+
+    def run(name, func):
+        queries, start = 0, time.perf_counter()
+        for i in range(requests):
+            with CaptureQueriesContext(connection) as context:
+                response = func(i)
+            assert response.status_code == 200, response.content
+            queries = len(context.captured_queries)
+        seconds = time.perf_counter() - start
+        results['view/{}'.format(name)] = {
+            'requests_per_second': requests / seconds if seconds else 0,
+            'queries': queries,
+        }
+
+    def do_create(i):
+        response = create(make_request('post', '/', {'name': 'created {}'.format(i)}, **ajax))
+        created.append(json.loads(response.content.decode('utf-8'))['id'])
+        return response
+
+    run('create_get', lambda i: create(make_request()).render())
+    run('create', do_create)
+    run('update', lambda i: update(make_request('post', '/', {'name': 'updated {}'.format(i)}, **ajax),
+                                   pk=created[i]))
+    run('delete', lambda i: delete(make_request('post'), pk=created[i]))
+    return results
+
+
+def run_benchmarks(sizes=(1000, 100000), widget_counts=(1, 10, 50), modes=tuple(MODES), requests=200, repeat=5):
+    ensure_tables()
+    results = {}
+    for size in sizes:
+        populate(size)
+        results.update(bench_widgets(size, modes, repeat))
+    populate(min(sizes))
+    results.update(bench_formsets(widget_counts, modes, repeat))
+    results.update(bench_views(requests))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return the regressions of results against baseline, time and bytes may grow by tolerance,
+    the number of queries may not grow
+    """
+    regressions = []
+    for key, current in sorted(results.items()):
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        for metric, value in sorted(current.items()):
+            if metric not in previous:
+                continue
+            old = previous[metric]
+            if metric == 'queries':
+                worse = value > old
+            elif metric == 'requests_per_second':
+                worse = value < old * (1 - tolerance)
+            else:
+                worse = value > old * (1 + tolerance)
+            if worse:
+                regressions.append('{} {}: {} -> {}'.format(key, metric, old, value))
+    return regressions
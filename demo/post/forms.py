@@ -6,10 +6,9 @@ from .models import *
 
 class PostForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
-        request = kwargs.pop('request')
+        # the popup widgets take the request from PopupRequestMiddleware
+        kwargs.pop('request', None)
         super(PostForm, self).__init__(*args, **kwargs)
-        self.fields['category'].widget.request = request
-        self.fields['tags'].widget.request = request
         self.fields['title'].widget.attrs.update({'class': 'layui-input'})
         self.fields['category'].widget.attrs.update({'class': 'layui-input', 'lay-ignore': ''})
         self.fields['tags'].widget.attrs.update({'class': 'layui-textarea', 'lay-ignore': ''})
@@ -0,0 +1,63 @@
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from post.benchmarks import MODES, compare, run_benchmarks
+
+
+def int_list(value):
+    return tuple(int(item) for item in value.split(',') if item)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark popup widgets rendering and popup CRUD views on a temporary SQLite database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int_list, default=(1000, 100000),
+                            help='rows of Category and Tag, comma separated, e.g. 1000,100000,1000000')
+        parser.add_argument('--widgets', type=int_list, default=(1, 10, 50),
+                            help='formset rows rendered, each row has two widgets')
+        parser.add_argument('--modes', default=','.join(MODES),
+                            help='widget render modes: {}'.format(', '.join(MODES)))
+        parser.add_argument('--requests', type=int, default=200, help='requests sent to each view')
+        parser.add_argument('--repeat', type=int, default=5, help='renders measured, the median is kept')
+        parser.add_argument('--output', help='save the results as json')
+        parser.add_argument('--baseline', help='json saved by --output, fail on regression against it')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='allowed growth of time and bytes against the baseline')
+
+    def handle(self, *args, **options):
+        modes = tuple(mode for mode in options['modes'].split(',') if mode)
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError('Unknown modes: {}'.format(', '.join(sorted(unknown))))
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = run_benchmarks(sizes=options['sizes'], widget_counts=options['widgets'], modes=modes,
+                                     requests=options['requests'], repeat=options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for key, metrics in sorted(results.items()):
+            self.stdout.write('{:<45} {}'.format(key, ' '.join(
+                '{}={:.6g}'.format(metric, value) for metric, value in sorted(metrics.items()))))
+
+        if options['output']:
+            data = {
+                'meta': {'django': django.get_version(), 'python': platform.python_version()},
+                'results': results,
+            }
+            with open(options['output'], 'w') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['results']
+            regressions = compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against {}:\n{}'.format(options['baseline'], '\n'.join(regressions)))
+            self.stdout.write('No regression against {}'.format(options['baseline']))
@@ -42,6 +42,7 @@ class CategoryPopupCRUDViewSet(PopupCRUDViewSet):
     model = Category
     form_class = CategoryForm
     context_for_update = {'demo': 'demo1'}
+    search_fields = ('name',)
     # parent_class = IsStaffUserMixin
     # template_name_create = 'popup/create.html'
     # template_name_update = 'popup/update.html'
@@ -50,6 +51,7 @@ class CategoryPopupCRUDViewSet(PopupCRUDViewSet):
 class TagPopupCRUDViewSet(PopupCRUDViewSet):
     model = Tag
     form_class = TagForm
+    search_fields = ('name',)
     # parent_class = IsStaffUserMixin
     # template_name_create = 'popup/create.html'
     # template_name_update = 'popup/update.html'
@@ -1,3 +1,913 @@
-from django.test import TestCase
+import copy
+import io
+import json
+import pickle
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django import forms
+from django.forms import formset_factory
+from django.contrib.auth.management import create_permissions
+from django.contrib.auth.models import Permission, User
+from django.db import IntegrityError, connection, transaction
+from django.apps import apps
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from popup_field import cache, metrics
+from popup_field.checks import check_viewset
+from popup_field.views import PopupBulkDeleteView, PopupCRUDViewSet
+from popup_field.middleware import PopupRequestMiddleware
+from popup_field.permissions import get_permission_resolver
+from .benchmarks import compare, ensure_tables, make_form_class, make_request, run_benchmarks
+from .models import Category, Post, Tag
+from .popups import CategoryPopupCRUDViewSet, TagPopupCRUDViewSet
+
+
+class UpperCategoryField(forms.ModelChoiceField):
+    def label_from_instance(self, obj):
+        return obj.name.upper()
+
+
+class PopupTestCase(TransactionTestCase):
+    def setUp(self):
+        # the demo ships without migrations, its permissions are only created by the flush of the first test
+        ensure_tables()
+        create_permissions(apps.get_app_config('post'), verbosity=0)
+
+    def make_viewer(self):
+        """
+        A user with the view permission of the demo models, asked by choices、export and changes
+        """
+        user = User.objects.create_user('viewer')
+        user.user_permissions.set(Permission.objects.filter(content_type__app_label='post',
+                                                            codename__startswith='view_'))
+        return user
+
+
+class BenchmarkTestCase(PopupTestCase):
+    def test_run_benchmarks(self):
+        results = run_benchmarks(sizes=(20,), widget_counts=(2,), requests=3, repeat=1)
+        self.assertIn('render/full/rows=20', results)
+        self.assertIn('view/delete', results)
+        # remote and selected_only render only the selected values
+        self.assertLess(results['render/remote/rows=20']['bytes'], results['render/full/rows=20']['bytes'])
+        self.assertEqual(compare(results, results, 0.2), [])
+
+    def test_compare(self):
+        baseline = {'render/full/rows=20': {'seconds': 1.0, 'bytes': 100, 'queries': 2}}
+        results = {'render/full/rows=20': {'seconds': 1.1, 'bytes': 100, 'queries': 3}}
+        self.assertEqual(compare(results, baseline, 0.2), ['render/full/rows=20 queries: 2 -> 3'])
+
+
+class MetricsTestCase(PopupTestCase):
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+        self.backend = metrics.add_backend(metrics.MemoryBackend())
+
+    def tearDown(self):
+        metrics.remove_backend(self.backend)
+
+    def test_views(self):
+        category = Category.objects.create(name='python')
+        self.client.post('/category/popup/', {'name': 'django'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.client.post('/category/popup/delete/{}/'.format(category.pk))
+        summary = self.backend.summary()
+        self.assertEqual(summary[('view.create', 'CategoryPopupCRUDViewSet')]['count'], 1)
+        self.assertEqual(summary[('view.delete', 'CategoryPopupCRUDViewSet')]['count'], 1)
+        self.assertGreater(summary[('view.create', 'CategoryPopupCRUDViewSet')]['queries'], 0)
+
+    def test_prefetch(self):
+        response = self.client.get('/category/popup/', HTTP_SEC_PURPOSE='prefetch')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=10')
+        self.client.get('/category/popup/', HTTP_PURPOSE='prefetch')
+        self.assertNotIn('max-age', self.client.get('/category/popup/').get('Cache-Control', ''))
+        tags = [data.get('prefetch', False) for name, viewset, data in self.backend.events if name == 'view.create']
+        self.assertEqual(tags, [True, True, False])
+
+    def test_preload_widget(self):
+        widget = forms.ModelChoiceField(queryset=Category.objects.all(),
+                                        widget=CategoryPopupCRUDViewSet.get_fk_popup_field(preload=True)).widget
+        self.assertIn('data-preload="10000"', widget.render('category', None, {'id': 'id_category'}))
+
+
+class ChoicesCacheTestCase(PopupTestCase):
+    def setUp(self):
+        super(ChoicesCacheTestCase, self).setUp()
+        CategoryPopupCRUDViewSet.cache_choices = True
+        cache.connect_signals(Category)
+
+    def tearDown(self):
+        CategoryPopupCRUDViewSet.cache_choices = False
+
+    def render(self):
+        field = forms.ModelChoiceField(queryset=Category.objects.all(),
+                                       widget=CategoryPopupCRUDViewSet.get_fk_popup_field())
+        return field.widget.render('category', None)
+
+    def test_cached_until_changed(self):
+        Category.objects.create(name='python')
+        self.assertIn('python', self.render())
+        with self.assertNumQueries(0):
+            self.assertIn('python', self.render())
+        Category.objects.create(name='django')
+        self.assertIn('django', self.render())
+        self.client.post('/category/popup/', {'name': 'flask'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertIn('flask', self.render())
+
+    def test_field_options(self):
+        Category.objects.create(name='python')
+        self.assertIn('---------', self.render())
+        field = forms.ModelChoiceField(queryset=Category.objects.all(), empty_label=None,
+                                       widget=CategoryPopupCRUDViewSet.get_fk_popup_field())
+        with self.assertNumQueries(0):
+            content = field.widget.render('category', None)
+        self.assertNotIn('---------', content)
+        self.assertIn('python', content)
+        field = UpperCategoryField(queryset=Category.objects.all(), widget=CategoryPopupCRUDViewSet.get_fk_popup_field())
+        self.assertIn('>PYTHON</option>', field.widget.render('category', None))
+        self.assertIn('>python</option>', self.render())
+
+    def test_warm_cache(self):
+        Category.objects.create(name='python')
+        out = io.StringIO()
+        call_command('popup_warm_cache', 'CategoryPopupCRUDViewSet', stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), ['CategoryPopupCRUDViewSet ForeignKey: 1 choices cached',
+                                                       'CategoryPopupCRUDViewSet ManyToManyField: 1 choices cached'])
+        with self.assertNumQueries(0):
+            self.assertIn('python', self.render())
+
+    def test_bumped_after_commit(self):
+        version = cache.get_version(Category)
+        with transaction.atomic():
+            Category.objects.create(name='python')
+            self.assertEqual(cache.get_version(Category), version)
+        self.assertNotEqual(cache.get_version(Category), version)
+        version = cache.get_version(Category)
+        with self.assertRaises(ValueError), transaction.atomic():
+            Category.objects.create(name='django')
+            raise ValueError
+        self.assertEqual(cache.get_version(Category), version)
+
+
+class AsyncViewsTestCase(PopupTestCase):
+    def setUp(self):
+        super(AsyncViewsTestCase, self).setUp()
+        CategoryPopupCRUDViewSet.async_views = True
+        CategoryPopupCRUDViewSet.reset_views()
+
+    def tearDown(self):
+        CategoryPopupCRUDViewSet.async_views = False
+        CategoryPopupCRUDViewSet.reset_views()
+
+    def test_views(self):
+        create, update, delete = [CategoryPopupCRUDViewSet.get_view(action) for action in ('create', 'update', 'delete')]
+        self.assertTrue(create.view_class.view_is_async)
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+        response = async_to_sync(create)(make_request('post', '/', {'name': 'django'}, **ajax))
+        pk = json.loads(response.content.decode('utf-8'))['id']
+        response = async_to_sync(update)(make_request('post', '/', {'name': 'flask'}, **ajax), pk=pk)
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['value'], 'flask')
+        response = async_to_sync(update)(make_request(), pk=pk)
+        self.assertIn('flask', response.render().content.decode('utf-8'))
+        response = async_to_sync(delete)(make_request('post'), pk=pk)
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['op'], 'delete')
+        self.assertFalse(Category.objects.filter(pk=pk).exists())
+
+    def test_head(self):
+        create, update = [CategoryPopupCRUDViewSet.get_view(action) for action in ('create', 'update')]
+        pk = Category.objects.create(name='django').pk
+        self.assertEqual(async_to_sync(create)(make_request('head')).status_code, 200)
+        self.assertEqual(async_to_sync(update)(make_request('head'), pk=pk).status_code, 200)
+
+
+class ConditionalGetTestCase(PopupTestCase):
+    def setUp(self):
+        super(ConditionalGetTestCase, self).setUp()
+        CategoryPopupCRUDViewSet.conditional_get = True
+        CategoryPopupCRUDViewSet.cache_create_page = True
+        CategoryPopupCRUDViewSet.reset_views()
+
+    def tearDown(self):
+        CategoryPopupCRUDViewSet.conditional_get = False
+        CategoryPopupCRUDViewSet.cache_create_page = False
+        CategoryPopupCRUDViewSet.reset_views()
+
+    def get(self, to_field='id_category', **extra):
+        create = CategoryPopupCRUDViewSet.get_view('create')
+        response = create(make_request(data={'to_field': to_field}, CSRF_COOKIE='a' * 32, **extra))
+        return response.render() if hasattr(response, 'render') else response
+
+    def test_create(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        cached = self.get()
+        self.assertEqual(cached['ETag'], etag)
+        self.assertIn('csrfmiddlewaretoken', cached.content.decode('utf-8'))
+        self.assertNotEqual(self.get(to_field='id_tags')['ETag'], etag)
+
+
+class FragmentTestCase(PopupTestCase):
+    def test_fragment(self):
+        content = self.client.get('/category/popup/?to_field=id_category&fragment=1').content.decode('utf-8')
+        self.assertTrue(content.startswith('<form'))
+        self.assertIn('action="/category/popup/?to_field=id_category&amp;fragment=1"', content)
+        self.assertNotIn('<html', content)
+
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        response = self.client.post('/category/popup/?to_field=id_category&fragment=1', {'name': ''}, **ajax)
+        self.assertIn('<form', response.content.decode('utf-8'))
+        response = self.client.post('/category/popup/?to_field=id_category&fragment=1', {'name': 'django'}, **ajax)
+        self.assertEqual(response.json()['value'], 'django')
+
+
+class ChangeLogTestCase(PopupTestCase):
+    def setUp(self):
+        super(ChangeLogTestCase, self).setUp()
+        CategoryPopupCRUDViewSet.change_log = True
+
+    def tearDown(self):
+        CategoryPopupCRUDViewSet.change_log = False
+
+    def test_changes(self):
+        self.client.force_login(self.make_viewer())
+        token = self.client.get('/category/popup/changes/').json()['token']
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        pk = self.client.post('/category/popup/', {'name': 'django'}, **ajax).json()['id']
+        self.client.post('/category/popup/{}/'.format(pk), {'name': 'flask'}, **ajax)
+        self.client.post('/category/popup/delete/{}/'.format(pk))
+
+        data = self.client.get('/category/popup/changes/', {'since': token}).json()
+        self.assertFalse(data['reset'])
+        self.assertEqual([(change['op'], change['id'], change['value']) for change in data['changes']],
+                         [('create', pk, 'django'), ('update', pk, 'flask'), ('delete', pk, 'flask')])
+        self.assertEqual(self.client.get('/category/popup/changes/', {'since': data['token']}).json()['changes'], [])
+        self.assertTrue(self.client.get('/category/popup/changes/', {'since': token - 1000}).json()['reset'])
+
+
+class SharedChoicesTestCase(PopupTestCase):
+    def test_formset(self):
+        categories = [Category.objects.create(name='category {}'.format(i)) for i in range(5)]
+        formset = formset_factory(make_form_class('shared'), extra=0)(
+            initial=[{'category': category.pk} for category in categories])
+        request = make_request()
+        for form in formset:
+            for name in ('category', 'tags'):
+                form.fields[name].widget.request = request
+        # one query for categories and one for tags, whatever the number of rows
+        with self.assertNumQueries(2):
+            content = str(formset)
+        self.assertEqual(content.count('category 4</option>'), 1)
+        self.assertEqual(content.count('"category 4"'), 1)
+        self.assertIn('data-shared-choices="popup-choices-category-', content)
+
+    def test_labels(self):
+        Category.objects.create(name='python')
+        request = make_request()
+        default, upper, no_empty = [
+            field_class(queryset=Category.objects.all(),
+                        widget=CategoryPopupCRUDViewSet.get_fk_popup_field(shared_choices=True), **kwargs).widget
+            for field_class, kwargs in ((forms.ModelChoiceField, {}), (UpperCategoryField, {}),
+                                        (forms.ModelChoiceField, {'empty_label': None}))]
+        contents = []
+        for widget in (default, upper, no_empty):
+            widget.request = request
+            contents.append(widget.render('category', None))
+        self.assertEqual(len(request._popup_shared_choices), 3)
+        self.assertIn('"python"', contents[0])
+        self.assertIn('"PYTHON"', contents[1])
+        self.assertIn('---------', contents[0])
+        self.assertNotIn('---------', contents[2])
+
+
+class CompletionTestCase(PopupTestCase):
+    name = '</script><script>alert(1)</script>'
+
+    def tearDown(self):
+        CategoryPopupCRUDViewSet.completion_mode = None
+        CategoryPopupCRUDViewSet.reset_views()
+
+    def create(self, **extra):
+        request = make_request('post', '/?to_field=id_category', {'name': self.name}, **extra)
+        response = CategoryPopupCRUDViewSet.get_view('create')(request)
+        if hasattr(response, 'render'):
+            response.render()
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode('utf-8')
+
+    def test_json(self):
+        data = json.loads(self.create(HTTP_ACCEPT='application/json'))
+        category = Category.objects.get()
+        self.assertEqual(data, {'op': 'create', 'id': category.pk, 'value': self.name, 'to_field': 'id_category'})
+
+    def test_message(self):
+        CategoryPopupCRUDViewSet.completion_mode = 'message'
+        CategoryPopupCRUDViewSet.reset_views()
+        content = self.create()
+        # only the closing tag of the snippet, no external asset
+        self.assertEqual(content.count('</script>'), 1)
+        self.assertNotIn('src=', content)
+        self.assertIn('postMessage', content)
+        self.assertIn('"value": "\\u003c/script\\u003e\\u003cscript\\u003ealert(1)\\u003c/script\\u003e"', content)
+
+    def test_template(self):
+        CategoryPopupCRUDViewSet.completion_mode = 'template'
+        CategoryPopupCRUDViewSet.reset_views()
+        content = self.create()
+        self.assertIn('parent.popupField.complete', content)
+        self.assertIn("value: '\\u003C/script\\u003E\\u003Cscript\\u003Ealert(1)\\u003C/script\\u003E'", content)
+        self.assertNotIn(self.name, content)
+
+
+class SelectedOnlyTestCase(PopupTestCase):
+    def test_queries(self):
+        categories = [Category.objects.create(name='category {}'.format(i)) for i in range(20)]
+        tags = [Tag.objects.create(name='tag {}'.format(i)) for i in range(20)]
+        form = make_form_class('selected_only')()
+        category, tags_widget = form.fields['category'].widget, form.fields['tags'].widget
+        # one pk__in query for the selected values, whatever the size of the table
+        with self.assertNumQueries(1):
+            content = category.render('category', categories[3].pk)
+        self.assertIn('<option value="{}" selected>category 3</option>'.format(categories[3].pk), content)
+        self.assertNotIn('category 4', content)
+        with self.assertNumQueries(1):
+            content = tags_widget.render('tags', [tags[1].pk, tags[2].pk])
+        self.assertEqual(content.count(' selected>'), 2)
+        # nothing to query for empty or invalid values
+        for value in (None, '', 'abc', [], ['abc']):
+            with self.assertNumQueries(0):
+                category.render('category', value)
+                tags_widget.render('tags', value)
+
+
+class LabelShapingTestCase(PopupTestCase):
+    def setUp(self):
+        super(LabelShapingTestCase, self).setUp()
+        CategoryPopupCRUDViewSet.label_prefetch_related = ('post_category',)
+        CategoryPopupCRUDViewSet.label_from_instance = lambda category: '{} ({})'.format(
+            category.name, len(category.post_category.all()))
+        CategoryPopupCRUDViewSet.reset_views()
+        self.viewer = self.make_viewer()
+
+    def tearDown(self):
+        del CategoryPopupCRUDViewSet.label_prefetch_related
+        del CategoryPopupCRUDViewSet.label_from_instance
+        CategoryPopupCRUDViewSet.reset_views()
+
+    def count_queries(self, rows):
+        for i in range(rows):
+            Post.objects.create(title='post', category=Category.objects.create(name='category {}'.format(i)))
+        widget = make_form_class('full')().fields['category'].widget
+        request = make_request(data={'limit': rows})
+        request.user = User.objects.get(pk=self.viewer.pk)
+        with CaptureQueriesContext(connection) as render:
+            content = widget.render('category', None)
+        with CaptureQueriesContext(connection) as choices:
+            response = CategoryPopupCRUDViewSet.get_view('choices')(request)
+        self.assertEqual(content.count(' (1)</option>'), Category.objects.count())
+        self.assertEqual(len(json.loads(response.content.decode('utf-8'))['results']), rows)
+        return len(render.captured_queries), len(choices.captured_queries)
+
+    def test_constant_queries(self):
+        # the categories and their posts, whatever the number of rows, and the permissions of the viewer
+        self.assertEqual(self.count_queries(5), (2, 4))
+        self.assertEqual(self.count_queries(15), (2, 4))
+
+
+class PermissionResolverTestCase(PopupTestCase):
+    def setUp(self):
+        super(PermissionResolverTestCase, self).setUp()
+        for viewset in (CategoryPopupCRUDViewSet, TagPopupCRUDViewSet):
+            opts = viewset.model._meta
+            viewset.permissions_required = {
+                action: ('post.{}_{}'.format(perm, opts.model_name),)
+                for action, perm in (('create', 'add'), ('update', 'change'), ('delete', 'delete'))}
+            viewset.label_only = ('name',)
+        self.user = User.objects.create_user('editor')
+        self.user.user_permissions.set(Permission.objects.filter(
+            content_type__app_label='post', codename__in=('add_category', 'change_category', 'delete_tag')))
+
+    def tearDown(self):
+        for viewset in (CategoryPopupCRUDViewSet, TagPopupCRUDViewSet):
+            del viewset.permissions_required
+            del viewset.label_only
+
+    def render(self, rows):
+        categories = [Category.objects.create(name='category {}'.format(i)) for i in range(rows)]
+        formset = formset_factory(make_form_class('shared'), extra=0)(
+            initial=[{'category': category.pk} for category in categories])
+        request = make_request()
+        # a new user object, without the permissions cached by an earlier render
+        request.user = User.objects.get(pk=self.user.pk)
+        for form in formset:
+            for name in ('category', 'tags'):
+                form.fields[name].widget.request = request
+        with CaptureQueriesContext(connection) as context:
+            content = str(formset)
+        return content, len(context.captured_queries), get_permission_resolver(request)
+
+    def test_counters(self):
+        content, queries, resolver = self.render(2)
+        # each viewset is checked once, the other widgets reuse it
+        self.assertEqual((resolver.checks, resolver.skipped), (6, 6))
+        self.assertEqual(content.count('data-popup-action="change"'), 2)
+        self.assertEqual(content.count('data-popup-action="delete"'), 2)
+        content, more_queries, resolver = self.render(20)
+        self.assertEqual((resolver.checks, resolver.skipped), (6, 114))
+        self.assertEqual(content.count('data-popup-action="change"'), 20)
+        # the permissions of the user, the categories and the tags with their shaped labels
+        self.assertEqual(more_queries, queries)
+        self.assertEqual(queries, 4)
+
+
+class SearchBackendTestCase(PopupTestCase):
+    def setUp(self):
+        super(SearchBackendTestCase, self).setUp()
+        CategoryPopupCRUDViewSet.search_backend = 'popup_field.search.SQLiteFTS5SearchBackend'
+        CategoryPopupCRUDViewSet.reset_views()
+        CategoryPopupCRUDViewSet.get_search_backend().connect()
+        self.viewer = self.make_viewer()
+
+    def tearDown(self):
+        CategoryPopupCRUDViewSet.get_search_backend().disconnect()
+        CategoryPopupCRUDViewSet.search_backend = None
+        CategoryPopupCRUDViewSet.write_db = None
+        CategoryPopupCRUDViewSet.reset_views()
+
+    def search(self, q):
+        request = make_request(data={'q': q})
+        request.user = self.viewer
+        response = CategoryPopupCRUDViewSet.get_view('choices')(request)
+        return [item['value'] for item in json.loads(response.content.decode('utf-8'))['results']]
+
+    def test_fts5(self):
+        Category.objects.create(name='django')
+        CategoryPopupCRUDViewSet.get_search_backend().rebuild()
+        self.assertEqual(self.search('jan'), ['django'])
+
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        create = CategoryPopupCRUDViewSet.get_view('create')
+        pk = json.loads(create(make_request('post', '/', {'name': 'flask'}, **ajax)).content.decode('utf-8'))['id']
+        self.assertEqual(self.search('las'), ['flask'])
+        CategoryPopupCRUDViewSet.get_view('delete')(make_request('post'), pk=pk)
+        self.assertEqual(self.search('las'), [])
+        # shorter queries use icontains
+        self.assertEqual(self.search('dj'), ['django'])
+
+    def test_indexed_once(self):
+        CategoryPopupCRUDViewSet.write_db = 'default'
+        CategoryPopupCRUDViewSet.get_search_backend().rebuild()
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        with CaptureQueriesContext(connection) as context:
+            CategoryPopupCRUDViewSet.get_view('create')(make_request('post', '/', {'name': 'flask'}, **ajax))
+        self.assertEqual(len([query for query in context.captured_queries
+                              if query['sql'].startswith('INSERT INTO "popup_fts_')]), 1)
+        # bulk_create sends no signal, the view indexes its rows
+        bulk_create = CategoryPopupCRUDViewSet.get_view('bulk_create')
+        bulk_create(make_request('post', '/', {'names': 'django\npyramid'}))
+        self.assertEqual(self.search('yra'), ['pyramid'])
+        self.assertEqual(self.search('jan'), ['django'])
+
+    def make_viewset(self, model, **attrs):
+        # a viewset built without model is not registered, the checks of the demo don't see it
+        viewset = type('Other{}PopupCRUDViewSet'.format(model.__name__), (PopupCRUDViewSet,),
+                       dict(attrs, search_backend='popup_field.search.SQLiteFTS5SearchBackend'))
+        viewset.model = model
+        self.addCleanup(viewset.get_search_backend().disconnect)
+        return viewset
+
+    def test_two_viewsets(self):
+        other = self.make_viewset(Category, search_fields=('name',))
+        other.get_search_backend().connect()
+        Category.objects.create(name='pyramid')
+        self.assertEqual(self.search('yra'), ['pyramid'])
+        self.assertEqual(list(other.get_search_backend().search(Category.objects.all(), 'yra')),
+                         list(Category.objects.all()))
+
+    def test_fallback(self):
+        from django.contrib.sessions.models import Session
+        from django.utils import timezone
+
+        # no search fields: nothing connected, saves work
+        backend = self.make_viewset(Category).get_search_backend()
+        backend.connect()
+        self.assertEqual(backend.get_unsupported_reason(), 'no search_fields')
+        Category.objects.create(name='django')
+        # the primary key is the rowid of the index
+        viewset = self.make_viewset(Session, search_fields=('session_data',))
+        viewset.get_search_backend().connect()
+        Session.objects.create(session_key='a' * 32, session_data='django', expire_date=timezone.now())
+        self.assertIn('popup_field.W002', [error.id for error in check_viewset(viewset)])
+        self.assertEqual(viewset.get_search_backend().search(Session.objects.all(), 'jan').count(), 1)
+        # no trigram tokenizer, searches use icontains
+        with mock.patch('popup_field.search.has_trigram', return_value=False):
+            Category.objects.create(name='flask')
+            self.assertEqual(self.search('las'), ['flask'])
+            self.assertEqual([error.id for error in check_viewset(CategoryPopupCRUDViewSet)], ['popup_field.W002'])
+        self.assertEqual(self.search('jan'), ['django'])
+
+
+class SearchCacheTestCase(PopupTestCase):
+    def setUp(self):
+        super(SearchCacheTestCase, self).setUp()
+        CategoryPopupCRUDViewSet.search_cache = True
+        CategoryPopupCRUDViewSet.reset_views()
+        cache.connect_signals(Category)
+        self.viewer = self.make_viewer()
+
+    def tearDown(self):
+        CategoryPopupCRUDViewSet.search_cache = False
+        CategoryPopupCRUDViewSet.reset_views()
+
+    def search(self, q, **data):
+        data['q'] = q
+        request = make_request(data=data)
+        request.user = self.viewer
+        response = CategoryPopupCRUDViewSet.get_view('choices')(request)
+        return [item['value'] for item in json.loads(response.content.decode('utf-8'))['results']]
+
+    def test_cached_until_changed(self):
+        Category.objects.create(name='python')
+        self.assertEqual(self.search('py'), ['python'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search('py'), ['python'])
+        # every query and page has its own entry
+        self.assertEqual(self.search('py', limit=1, after=0), ['python'])
+        self.assertEqual(self.search('go'), [])
+
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        CategoryPopupCRUDViewSet.get_view('create')(make_request('post', '/', {'name': 'pypy'}, **ajax))
+        self.assertEqual(self.search('py'), ['python', 'pypy'])
+
+
+class DatabaseRoutingTestCase(PopupTestCase):
+    def tearDown(self):
+        CategoryPopupCRUDViewSet.read_db = None
+
+    def test_read_db(self):
+        CategoryPopupCRUDViewSet.read_db = 'replica'
+        widget = forms.ModelChoiceField(queryset=Category.objects.all(),
+                                        widget=CategoryPopupCRUDViewSet.get_fk_popup_field()).widget
+        self.assertEqual(widget.get_queryset().db, 'replica')
+        # read your writes
+        widget.request = make_request()
+        widget.request.COOKIES[CategoryPopupCRUDViewSet.get_written_cookie_name()] = '1'
+        self.assertEqual(widget.get_queryset().db, 'default')
+
+    def test_written_cookie(self):
+        CategoryPopupCRUDViewSet.read_db = 'default'
+        create = CategoryPopupCRUDViewSet.get_view('create')
+        response = create(make_request('post', '/', {'name': 'django'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest'))
+        self.assertIn(CategoryPopupCRUDViewSet.get_written_cookie_name(), response.cookies)
+        self.assertNotIn(CategoryPopupCRUDViewSet.get_written_cookie_name(), create(make_request()).cookies)
+
+
+class ExportTestCase(PopupTestCase):
+    def test_view_permission(self):
+        viewer = self.make_viewer()
+        for action in ('choices', 'export', 'changes'):
+            view = CategoryPopupCRUDViewSet.get_view(action)
+            # anonymous users are sent to the login page
+            response = view(make_request())
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response.url.startswith(settings.LOGIN_URL))
+            request = make_request()
+            request.user = viewer
+            self.assertEqual(view(request).status_code, 200)
+        self.client.force_login(User.objects.create_user('writer'))
+        self.assertEqual(self.client.get('/category/popup/choices/').status_code, 403)
+
+    def test_export(self):
+        Category.objects.bulk_create([Category(name='category {}'.format(i)) for i in range(5)])
+        CategoryPopupCRUDViewSet.export_chunk_size = 2
+        CategoryPopupCRUDViewSet.reset_views()
+        try:
+            export = CategoryPopupCRUDViewSet.get_view('export')
+            viewer = self.make_viewer()
+            request = make_request()
+            request.user = viewer
+            response = export(request)
+            chunks = [chunk.decode('utf-8') for chunk in response.streaming_content]
+            self.assertEqual(len(chunks), 3)
+            rows = [json.loads(line) for line in ''.join(chunks).splitlines()]
+            self.assertEqual([row['value'] for row in rows], ['category {}'.format(i) for i in range(5)])
+            request = make_request(data={'format': 'json'})
+            request.user = viewer
+            response = export(request)
+            self.assertEqual(json.loads(b''.join(response.streaming_content).decode('utf-8')), rows)
+        finally:
+            CategoryPopupCRUDViewSet.export_chunk_size = 2000
+            CategoryPopupCRUDViewSet.reset_views()
+
+
+class LightweightWidgetTestCase(PopupTestCase):
+    def test_copy_shares_config(self):
+        field = forms.ModelChoiceField(queryset=Category.objects.all(),
+                                       widget=CategoryPopupCRUDViewSet.get_fk_popup_field())
+        copied = field.__deepcopy__({})
+        self.assertIs(copied.widget.config, field.widget.config)
+        self.assertIsNot(copied.widget.attrs, field.widget.attrs)
+        # setting an attribute gives the copy its own config
+        copied.widget.width = '100px'
+        self.assertEqual(field.widget.width, '700px')
+        self.assertEqual(copied.widget.width, '100px')
+
+    def test_copy_and_pickle(self):
+        widget = CategoryPopupCRUDViewSet.get_fk_popup_field()
+        config = widget.config
+        self.assertIs(copy.copy(config), config)
+        self.assertIs(copy.deepcopy(config), config)
+        self.assertIs(copy.deepcopy(widget).config, config)
+        with self.assertRaises(AttributeError):
+            config.width = '100px'
+        for obj in (config, widget):
+            restored = pickle.loads(pickle.dumps(obj))
+            restored_config = getattr(restored, 'config', restored)
+            self.assertIs(restored_config.viewset, CategoryPopupCRUDViewSet)
+            self.assertEqual(restored_config.urls, config.urls)
+            with self.assertRaises(AttributeError):
+                restored_config.width = '100px'
+
+    def test_request_from_middleware(self):
+        widget = forms.ModelChoiceField(queryset=Category.objects.all(),
+                                        widget=CategoryPopupCRUDViewSet.get_fk_popup_field()).widget
+        request = make_request()
+        middleware = PopupRequestMiddleware(lambda r: widget.request)
+        self.assertIs(middleware(request), request)
+        self.assertIsNone(widget.request)
+
+
+class ToFieldTestCase(PopupTestCase):
+    def setUp(self):
+        super(ToFieldTestCase, self).setUp()
+        # a viewset built without model is not registered
+        self.viewset = type('UserPopupCRUDViewSet', (PopupCRUDViewSet,), {'search_fields': ('username',)})
+        self.viewset.model = User
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+    def get(self, action, **data):
+        request = make_request(data=data)
+        request.user = self.admin
+        return self.viewset.get_view(action)(request)
+
+    def test_views(self):
+        User.objects.create_user('guest')
+        response = self.get('choices', to_field_name='username', q='gue')
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['results'], [{'id': 'guest', 'value': 'guest'}])
+        response = self.get('export', to_field_name='username')
+        self.assertEqual([json.loads(line)['id'] for line in b''.join(response.streaming_content).splitlines()],
+                         ['admin', 'guest'])
+        for name in ('first_name', 'groups', 'missing'):
+            self.assertEqual(self.get('choices', to_field_name=name).status_code, 400, name)
+            self.assertEqual(self.get('export', to_field_name=name).status_code, 400, name)
+        # the values of the choices validate in the field
+        field = forms.ModelChoiceField(queryset=User.objects.all(), to_field_name='username')
+        self.assertEqual(field.clean('guest').username, 'guest')
+
+    def render(self, **kwargs):
+        contents = [forms.ModelChoiceField(queryset=Category.objects.all(), to_field_name='id',
+                                           widget=CategoryPopupCRUDViewSet.get_fk_popup_field(
+                                               fast_render=fast_render, **kwargs)).widget.render(
+            'category', None, {'id': 'id_category'}) for fast_render in (False, True)]
+        self.assertEqual(contents[0], contents[1])
+        return contents[0]
+
+    def test_widget(self):
+        self.assertIn('data-to-field-name="id"', self.render(remote=True))
+        self.assertIn('data-export-url="/category/popup/export/?to_field_name=id"', self.render(stream=True))
+
+
+class AdminTestCase(PopupTestCase):
+    def setUp(self):
+        super(AdminTestCase, self).setUp()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+    def test_changelist(self):
+        for i in range(5):
+            Post.objects.create(title='post {}'.format(i), category=Category.objects.create(name='category {}'.format(i)))
+        with CaptureQueriesContext(connection) as queries:
+            content = self.client.get('/admin/post/post/').content.decode('utf-8')
+        self.assertIn('data-choices-url="/admin/post/post/category/popup/choices/"', content)
+        self.assertIn('category 4', content)
+        self.assertNotIn('related-widget-wrapper', content)
+        # the labels of every row in one query
+        self.assertEqual(len([query for query in queries if 'FROM "post_category"' in query['sql']]), 1)
+
+    def test_views(self):
+        content = self.client.get('/admin/post/post/add/').content.decode('utf-8')
+        self.assertIn('data-popup-field="id_tags"', content)
+        self.assertEqual(self.client.get('/admin/post/post/category/popup/choices/').status_code, 200)
+        self.client.logout()
+        self.assertEqual(self.client.get('/admin/post/post/category/popup/choices/').status_code, 302)
+
+    def test_staff_permissions(self):
+        category = Category.objects.create(name='python')
+        staff = User.objects.create_user('staff', is_staff=True)
+        staff.user_permissions.set(Permission.objects.filter(codename__in=('add_post', 'change_post')))
+        self.client.force_login(staff)
+        url = '/admin/post/post/category/popup/'
+        requests = [
+            ('get', url), ('post', url), ('get', '{}{}/'.format(url, category.pk)),
+            ('post', '{}{}/'.format(url, category.pk)), ('post', '{}delete/{}/'.format(url, category.pk)),
+            ('post', '{}bulk/'.format(url)), ('post', '{}delete/bulk/'.format(url)), ('get', '{}choices/'.format(url)),
+            ('get', '{}export/'.format(url)),
+        ]
+        for method, path in requests:
+            self.assertEqual(getattr(self.client, method)(path, {'name': 'django', 'pk': category.pk}).status_code,
+                             403, path)
+        self.assertTrue(Category.objects.filter(name='python').exists())
+        content = self.client.get('/admin/post/post/add/').content.decode('utf-8')
+        self.assertNotIn('data-popup-action="add"', content)
+        self.assertNotIn('data-popup-action="delete"', content)
+
+        staff.user_permissions.add(*Permission.objects.filter(codename__in=('add_category', 'view_category')))
+        self.assertEqual(self.client.get('{}choices/'.format(url)).status_code, 200)
+        self.assertEqual(self.client.post(url, {'name': 'django'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest').status_code,
+                         200)
+        content = self.client.get('/admin/post/post/add/').content.decode('utf-8')
+        self.assertIn('id="id_category_add" data-popup-action="add"', content)
+
+    def test_radio_fields(self):
+        from .admin import PostAdmin
+
+        PostAdmin.radio_fields = {'category': 1}
+        try:
+            content = self.client.get('/admin/post/post/add/').content.decode('utf-8')
+        finally:
+            del PostAdmin.radio_fields
+        self.assertNotIn('data-popup-field="id_category"', content)
+        self.assertIn('data-popup-field="id_tags"', content)
+
+
+class FastRenderTestCase(PopupTestCase):
+    def setUp(self):
+        super(FastRenderTestCase, self).setUp()
+        self.categories = [Category.objects.create(name=name) for name in ('python', '<b>"django" & \'co\'</b>')]
+        self.tags = [Tag.objects.create(name=name) for name in ('web', 'a < b')]
+
+    def render_both(self, viewset, method, queryset, value, request=False, permissions=None, **kwargs):
+        field_class = forms.ModelMultipleChoiceField if method == 'get_m2m_popup_field' else forms.ModelChoiceField
+        html = []
+        for fast_render in (False, True):
+            widget = field_class(queryset=queryset, widget=getattr(viewset, method)(fast_render=fast_render, **kwargs)).widget
+            widget.permissions_required = permissions
+            # shared choices are rendered once per request
+            widget.request = make_request() if request else None
+            html.append(widget.render('field', value, {'id': 'id_field', 'class': 'layui-input', 'lay-ignore': '',
+                                                       'required': True, 'disabled': False}))
+        return html
+
+    def test_byte_identical(self):
+        CategoryPopupCRUDViewSet.change_log = True
+        TagPopupCRUDViewSet.change_log = True
+        try:
+            for options in ({}, {'remote': True}, {'selected_only': True}, {'fragment': True, 'preload': True},
+                            {'stream': True}, {'shared_choices': True}, {'popup_name': '<i>名称</i>', 'width': '1"'}):
+                for request, permissions in ((False, {}), (True, {}), (True, {'create': ('post.add_category',)})):
+                    template, fast = self.render_both(CategoryPopupCRUDViewSet, 'get_fk_popup_field',
+                                                      Category.objects.all(), self.categories[1].pk, request,
+                                                      permissions, **options)
+                    self.assertEqual(template, fast, options)
+                    self.assertEqual('data-popup-action="add"' in fast, not permissions)
+                    template, fast = self.render_both(TagPopupCRUDViewSet, 'get_m2m_popup_field', Tag.objects.all(),
+                                                      [tag.pk for tag in self.tags], request, permissions, **options)
+                    self.assertEqual(template, fast, options)
+        finally:
+            CategoryPopupCRUDViewSet.change_log = False
+            TagPopupCRUDViewSet.change_log = False
+
+    def test_overridden_template(self):
+        widget = forms.ModelChoiceField(queryset=Category.objects.all(), widget=CategoryPopupCRUDViewSet.get_fk_popup_field(
+            fast_render=True, template_name='django/forms/widgets/select.html')).widget
+        self.assertTrue(widget.render('field', None).startswith('<select'))
+
+
+class FastDeleteTestCase(PopupTestCase):
+    def tearDown(self):
+        TagPopupCRUDViewSet.fast_delete = False
+        TagPopupCRUDViewSet.reset_views()
+
+    def bulk_delete(self, queries):
+        pks = [Tag.objects.create(name='tag {}'.format(i)).pk for i in range(5)]
+        with self.assertNumQueries(queries):
+            return TagPopupCRUDViewSet.get_view('bulk_delete')(make_request('post', '/', {'pk': pks}))
+
+    def test_collector(self):
+        # BEGIN, SELECT, one DELETE of the many to many table and of the tags for every row, COMMIT
+        self.assertEqual(self.bulk_delete(13).status_code, 200)
+        TagPopupCRUDViewSet.fast_delete = True
+        TagPopupCRUDViewSet.reset_views()
+        # the labels are not fetched again, the queryset delete fetches the pks once more for the collector
+        response = self.bulk_delete(6)
+        self.assertEqual([item['value'] for item in json.loads(response.content.decode('utf-8'))['results']],
+                         ['tag {}'.format(i) for i in range(5)])
+        tag = Tag.objects.create(name='python')
+        with self.assertNumQueries(6):
+            TagPopupCRUDViewSet.get_view('delete')(make_request('post'), pk=tag.pk)
+        self.assertFalse(Tag.objects.exists())
+
+    def test_fast_delete(self):
+        from django.contrib.sessions.models import Session
+        from django.utils import timezone
+
+        Session.objects.create(session_key='a' * 32, session_data='', expire_date=timezone.now())
+        view = PopupBulkDeleteView()
+        view.model = Session
+        sessions = list(Session.objects.all())
+        # nothing to collect, one DELETE query in the transaction of the queryset delete
+        with self.assertNumQueries(3):
+            self.assertEqual(view.delete_objects(sessions), 1)
+        self.assertFalse(Session.objects.exists())
+
+    def test_invalid_pks(self):
+        view = TagPopupCRUDViewSet.get_view('bulk_delete')
+        for body in ('{"pks": [{}]}', '{"pks": [[1]]}', '{"pks": [true]}', '{"pks": 1}', '[]', '{', '{"pks": ["a"]}'):
+            response = view(make_request('post', '/', body, content_type='application/json'))
+            self.assertEqual(response.status_code, 400, body)
+
+
+class BulkCreateTestCase(PopupTestCase):
+    def bulk_create(self, body, view=None):
+        view = view or TagPopupCRUDViewSet.get_view('bulk_create')
+        response = view(make_request('post', '/', body, content_type='application/json'))
+        return response.status_code, json.loads(response.content.decode('utf-8'))
+
+    def test_rows(self):
+        status, data = self.bulk_create('{"rows": [{"name": "python"}, {"name": 3}, {"name": ["django"]}]}')
+        self.assertEqual(status, 200)
+        self.assertEqual([item['value'] for item in data['results']], ['python', '3', 'django'])
+        response = TagPopupCRUDViewSet.get_view('bulk_create')(make_request('post', '/', {'names': 'flask\nflask'}))
+        self.assertEqual([item['value'] for item in json.loads(response.content.decode('utf-8'))['results']],
+                         ['flask'])
+        self.assertEqual(Tag.objects.count(), 4)
+
+    def test_invalid_rows(self):
+        status, data = self.bulk_create('{"rows": [{"name": "python"}, {"name": {"a": 1}}, {"name": [[1]]}, {}]}')
+        self.assertEqual(status, 400)
+        self.assertEqual(data['errors']['1'], {'name': ['invalid value']})
+        self.assertEqual(data['errors']['2'], {'name': ['invalid value']})
+        self.assertEqual(list(data['errors']['3']), ['name'])
+        self.assertNotIn('0', data['errors'])
+        for body in ('{', '[]', '{"rows": 1}', '{"rows": [1]}', '{"rows": []}'):
+            self.assertEqual(self.bulk_create(body)[0], 400, body)
+        self.assertFalse(Tag.objects.exists())
+
+    def test_integrity_error(self):
+        class BulkCreateView(TagPopupCRUDViewSet.bulk_create()):
+            def save(self, forms):
+                raise IntegrityError('UNIQUE constraint failed: post_tag.name')
+
+        status, data = self.bulk_create('{"rows": [{"name": "python"}]}', BulkCreateView.as_view())
+        self.assertEqual(status, 400)
+        self.assertNotIn('post_tag', data['error'])
+
+
+class ChecksTestCase(PopupTestCase):
+    def configure(self, **attrs):
+        for name, value in attrs.items():
+            if name in TagPopupCRUDViewSet.__dict__:
+                self.addCleanup(setattr, TagPopupCRUDViewSet, name, TagPopupCRUDViewSet.__dict__[name])
+            else:
+                self.addCleanup(delattr, TagPopupCRUDViewSet, name)
+            setattr(TagPopupCRUDViewSet, name, value)
+        self.addCleanup(TagPopupCRUDViewSet.reset_views)
+        TagPopupCRUDViewSet.reset_views()
+
+    def assertChecks(self, ids):
+        self.assertEqual([error.id for error in check_viewset(TagPopupCRUDViewSet)], ids)
+
+    def test_valid(self):
+        self.assertChecks([])
+
+    def test_errors(self):
+        with self.subTest('E001'):
+            self.configure(form_class=None)
+            self.assertChecks(['popup_field.E001'])
+        self.doCleanups()
+        with self.subTest('E002'), override_settings(POPUP_TEMPLATE_NAME_CREATE=None):
+            self.assertChecks(['popup_field.E002'])
+        with self.subTest('E003'):
+            self.configure(template_name_fk='post/missing.html')
+            self.assertChecks(['popup_field.E003'])
+        self.doCleanups()
+        with self.subTest('E004'):
+            self.configure(completion_mode='missing')
+            self.assertChecks(['popup_field.E004'])
+        self.doCleanups()
+        with self.subTest('E005'):
+            self.configure(search_backend='popup_field.search.MissingSearchBackend')
+            self.assertChecks(['popup_field.E005'])
+        self.doCleanups()
+        with self.subTest('W001'):
+            self.configure(fast_delete=True)
+            self.assertChecks(['popup_field.W001'])
+
+    def test_ready(self):
+        # a bad configuration is reported by the checks instead of failing at startup
+        self.configure(completion_mode='missing', search_backend='popup_field.search.MissingSearchBackend')
+        with override_settings(POPUP_TEMPLATE_NAME_CREATE=None):
+            apps.get_app_config('popup_field').ready()
+            self.assertChecks(['popup_field.E002', 'popup_field.E005'])
@@ -1 +1,9 @@
-__version__ = '0.1.6'
+__version__ = '0.2.0'
+
+try:
+    import django
+except ImportError:
+    pass
+else:
+    if django.VERSION < (3, 2):
+        default_app_config = 'popup_field.apps.PopupFieldConfig'
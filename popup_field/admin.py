@@ -0,0 +1,159 @@
+"""
+Popup widgets in django.contrib.admin.
+"""
+import functools
+
+import django
+from django.contrib.admin.widgets import RelatedFieldWidgetWrapper
+from django.contrib.auth import get_permission_codename
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured, PermissionDenied
+from django.db import models
+from django.utils.module_loading import import_string
+
+from .fields import PopupWidgetMixin, preload_labels
+from .views import registry
+
+# permission of the admin asked by each popup view, view is change before django 2.1
+ADMIN_PERMISSIONS = {
+    'create': 'add',
+    'bulk_create': 'add',
+    'update': 'change',
+    'delete': 'delete',
+    'bulk_delete': 'delete',
+    'choices': 'view',
+    'export': 'view',
+    'changes': 'view',
+}
+
+
+class PopupAdminMixin(object):
+    """
+    ModelAdmin mixin swapping ForeignKey and ManyToManyField to the popup widgets of their viewsets.
+    The views of the viewsets are served under the admin site, behind its permission check, and the widgets
+    load the choices from the choices view page by page. The labels of the list_editable rows of a changelist
+    are fetched with one query per column. Each view also asks the add、change、delete or view permission of
+    the ModelAdmin of the related model, or of the model when it isn't registered.
+
+        class PostAdmin(PopupAdminMixin, admin.ModelAdmin):
+            list_editable = ('category',)
+    """
+    # {field name: PopupCRUDViewSet or dotted path}, default is the viewset registered for the related model
+    popup_viewsets = {}
+    # fields left to the widgets of the admin
+    popup_exclude = ()
+    # load choices from the choices view, False renders every option
+    popup_remote_choices = True
+
+    def get_popup_viewset(self, db_field):
+        """
+        Return the viewset of db_field, None to keep the widget of the admin
+        """
+        if db_field.name in self.popup_exclude or db_field.name in self.raw_id_fields or \
+                db_field.name in self.autocomplete_fields or db_field.name in self.filter_horizontal or \
+                db_field.name in self.filter_vertical or db_field.name in self.radio_fields:
+            return None
+        viewset = self.popup_viewsets.get(db_field.name)
+        if isinstance(viewset, str):
+            viewset = import_string(viewset)
+        if viewset is None:
+            model = db_field.remote_field.model
+            viewset = next((viewset for viewset in registry if viewset.model is model), None)
+        return viewset
+
+    def get_popup_fields(self):
+        """
+        Return [(db_field, viewset)] of the relations shown with popup widgets
+        """
+        opts = self.model._meta
+        fields = []
+        for db_field in opts.fields + opts.many_to_many:
+            if isinstance(db_field, (models.ForeignKey, models.ManyToManyField)):
+                viewset = self.get_popup_viewset(db_field)
+                if viewset is not None:
+                    fields.append((db_field, viewset))
+        return fields
+
+    def get_popup_permissions_required(self, viewset):
+        """
+        Return permissions_required of the viewset with the add、change and delete permissions of the model,
+        the buttons of the widgets follow the permissions asked by the views
+        """
+        opts = viewset.model._meta
+        permissions_required = dict(viewset.permissions_required)
+        for action, permission in (('create', 'add'), ('update', 'change'), ('delete', 'delete')):
+            permissions_required[action] = tuple(permissions_required.get(action, ())) + (
+                '{}.{}'.format(opts.app_label, get_permission_codename(permission, opts)),)
+        return permissions_required
+
+    def get_popup_widget_kwargs(self, viewset, request):
+        return {'remote': self.popup_remote_choices, 'namespace': self.admin_site.name, 'request': request,
+                'permissions_required': self.get_popup_permissions_required(viewset)}
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        viewset = self.get_popup_viewset(db_field)
+        if viewset is not None and 'widget' not in kwargs:
+            kwargs['widget'] = viewset.get_fk_popup_field(**self.get_popup_widget_kwargs(viewset, request))
+        return super(PopupAdminMixin, self).formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        viewset = self.get_popup_viewset(db_field)
+        if viewset is not None and 'widget' not in kwargs:
+            kwargs['widget'] = viewset.get_m2m_popup_field(**self.get_popup_widget_kwargs(viewset, request))
+        return super(PopupAdminMixin, self).formfield_for_manytomany(db_field, request, **kwargs)
+
+    def formfield_for_dbfield(self, db_field, request, **kwargs):
+        formfield = super(PopupAdminMixin, self).formfield_for_dbfield(db_field, request, **kwargs)
+        # the popup widgets have their own add、change and delete buttons
+        if formfield is not None and isinstance(formfield.widget, RelatedFieldWidgetWrapper) and \
+                isinstance(formfield.widget.widget, PopupWidgetMixin):
+            formfield.widget = formfield.widget.widget
+        return formfield
+
+    def get_changelist_instance(self, request):
+        changelist = super(PopupAdminMixin, self).get_changelist_instance(request)
+        for name in self.list_editable:
+            try:
+                db_field = self.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if not isinstance(db_field, models.ForeignKey):
+                continue
+            viewset = self.get_popup_viewset(db_field)
+            if viewset is not None:
+                preload_labels(request, viewset, [getattr(obj, db_field.attname) for obj in changelist.result_list],
+                               db_field.remote_field.field_name)
+        return changelist
+
+    def has_popup_permission(self, request, viewset, permission):
+        """
+        Whether the user of request has permission, add、change、delete or view, on the model of viewset
+        """
+        if permission == 'view' and django.VERSION < (2, 1):
+            permission = 'change'
+        model_admin = self.admin_site._registry.get(viewset.model)
+        if model_admin is not None:
+            return getattr(model_admin, 'has_{}_permission'.format(permission))(request)
+        opts = viewset.model._meta
+        return request.user.has_perm('{}.{}'.format(opts.app_label, get_permission_codename(permission, opts)))
+
+    def popup_admin_view(self, view, viewset=None):
+        if viewset is not None:
+            permission = ADMIN_PERMISSIONS[view.view_class.popup_action]
+            inner = view
+
+            @functools.wraps(inner)
+            def view(request, *args, **kwargs):
+                if not self.has_popup_permission(request, viewset, permission):
+                    raise PermissionDenied
+                return inner(request, *args, **kwargs)
+
+        return self.admin_site.admin_view(view, cacheable=True)
+
+    def get_urls(self):
+        urls = []
+        for viewset in {viewset for db_field, viewset in self.get_popup_fields()}:
+            if viewset.async_views:
+                raise ImproperlyConfigured('{} serves async views, admin_view of the admin site can only call '
+                                           'sync views'.format(viewset.__name__))
+            urls.append(viewset.urls(decorator=functools.partial(self.popup_admin_view, viewset=viewset)))
+        return urls + super(PopupAdminMixin, self).get_urls()
@@ -0,0 +1,31 @@
+from django.apps import AppConfig
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import autodiscover_modules
+
+
+class PopupFieldConfig(AppConfig):
+    name = 'popup_field'
+    verbose_name = 'Popup Field'
+
+    def ready(self):
+        from .cache import connect_signals
+        from .checks import check_viewsets
+        from .views import registry
+
+        checks.register(check_viewsets, 'popup_field')
+        # import popups.py of every installed app and build the views of every viewset once, a bad configuration
+        # is left to the checks and the views are built on the first request then
+        autodiscover_modules('popups')
+        for viewset in registry:
+            try:
+                viewset.build_views()
+            except ImproperlyConfigured:
+                viewset.reset_views()
+            for model in viewset.get_watched_models():
+                connect_signals(model)
+            try:
+                backend = viewset.get_search_backend()
+            except ImportError:
+                continue
+            backend.connect()
@@ -0,0 +1,113 @@
+"""
+Per model versions of popup data kept in the django cache.
+
+The version of a model is part of every cache key built from its rows, bumping it after a write invalidates them
+all at once. Versions start from a timestamp, a version evicted from the cache never comes back to an old value.
+Versions live in the POPUP_CACHE_ALIAS cache, default is 'default'.
+
+The change log of a viewset is a counter, the change token, and one entry per change stored under its token.
+A client keeps the last token it has seen and asks for the entries after it.
+"""
+import functools
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+VERSION_KEY = 'popup_field:version:{}'
+CHANGES_KEY = 'popup_field:changes:{}'
+
+# models whose version is bumped by signals
+_watched = set()
+
+
+def get_cache(alias=None):
+    return caches[alias or getattr(settings, 'POPUP_CACHE_ALIAS', 'default')]
+
+
+def get_counter(key):
+    cache = get_cache()
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, int(time.time() * 1000), None)
+        value = cache.get(key, 0)
+    return value
+
+
+def incr_counter(key):
+    cache = get_cache()
+    try:
+        return cache.incr(key)
+    except ValueError:
+        value = int(time.time() * 1000)
+        cache.set(key, value, None)
+        return value
+
+
+def get_version(model):
+    return get_counter(VERSION_KEY.format(model._meta.label_lower))
+
+
+def bump_version(model):
+    return incr_counter(VERSION_KEY.format(model._meta.label_lower))
+
+
+def bump_version_receiver(sender, using=None, **kwargs):
+    # after the commit, a reader between the write and the commit would cache the old rows under the new version
+    transaction.on_commit(functools.partial(bump_version, sender), using=using)
+
+
+def connect_signals(model):
+    """
+    Bump the version of model after every save and delete.
+    A post_delete receiver turns off the fast delete of django for model.
+    """
+    uid = 'popup_field_version_{}'.format(model._meta.label_lower)
+    post_save.connect(bump_version_receiver, sender=model, dispatch_uid=uid)
+    post_delete.connect(bump_version_receiver, sender=model, dispatch_uid=uid)
+    _watched.add(model)
+
+
+def is_watched(model):
+    return model in _watched
+
+
+def get_change_token(name):
+    return get_counter(CHANGES_KEY.format(name))
+
+
+def log_changes(name, changes, timeout):
+    """
+    Append changes, [{'op': ..., 'id': ..., 'value': ...}], to the change log of name
+    """
+    key = CHANGES_KEY.format(name)
+    get_counter(key)
+    entries = {}
+    for change in changes:
+        entries['{}:{}'.format(key, incr_counter(key))] = change
+    get_cache().set_many(entries, timeout)
+
+
+def get_changes(name, since, limit):
+    """
+    Return (token, changes after since, complete). The log is incomplete when since is too old or an entry
+    in the middle expired, a missing entry at the end is still being written and is returned by a later call.
+    """
+    key = CHANGES_KEY.format(name)
+    token = get_counter(key)
+    if since >= token:
+        return token, [], since == token
+    if token - since > limit:
+        return token, [], False
+    keys = ['{}:{}'.format(key, index) for index in range(since + 1, token + 1)]
+    found = get_cache().get_many(keys)
+    changes = []
+    for index, entry_key in enumerate(keys):
+        if entry_key not in found:
+            if any(later in found for later in keys[index + 1:]):
+                return token, [], False
+            return since + index, changes, True
+        changes.append(found[entry_key])
+    return token, changes, True
@@ -0,0 +1,90 @@
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db.models import DO_NOTHING
+from django.db.models.deletion import get_candidate_relations_to_delete
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+from django.template.loader import get_template
+
+from .fields import ForeignKeyWidget, ManyToManyWidget
+from .search import SQLiteFTS5SearchBackend
+
+
+def check_template(viewset, template_name, errors):
+    try:
+        get_template(template_name)
+    except TemplateDoesNotExist:
+        errors.append(checks.Error(
+            'Template {} of {} does not exist.'.format(template_name, viewset.__name__),
+            obj=viewset, id='popup_field.E003'))
+    except TemplateSyntaxError as e:
+        errors.append(checks.Error(
+            'Template {} of {} is invalid: {}'.format(template_name, viewset.__name__, e),
+            obj=viewset, id='popup_field.E003'))
+
+
+def check_viewset(viewset):
+    errors = []
+    if viewset.form_class is None:
+        errors.append(checks.Error(
+            '{} must set form_class.'.format(viewset.__name__), obj=viewset, id='popup_field.E001'))
+
+    for get_template_name in (viewset.get_template_name_create, viewset.get_template_name_update):
+        try:
+            template_name = get_template_name()
+        except ImproperlyConfigured as e:
+            errors.append(checks.Error(str(e), obj=viewset, id='popup_field.E002'))
+        else:
+            check_template(viewset, template_name, errors)
+    if viewset.fragment:
+        check_template(viewset, viewset.get_template_name_fragment(), errors)
+    check_template(viewset, viewset.template_name_fk or ForeignKeyWidget.template_name, errors)
+    check_template(viewset, viewset.template_name_m2m or ManyToManyWidget.template_name, errors)
+
+    if not errors:
+        try:
+            viewset.build_views()
+        except ImproperlyConfigured as e:
+            errors.append(checks.Error(str(e), obj=viewset, id='popup_field.E004'))
+
+    try:
+        backend = viewset.get_search_backend()
+    except ImportError as e:
+        errors.append(checks.Error(
+            'Search backend of {} can not be imported: {}'.format(viewset.__name__, e),
+            obj=viewset, id='popup_field.E005'))
+    else:
+        if isinstance(backend, SQLiteFTS5SearchBackend):
+            reason = backend.get_unsupported_reason(connections[backend.get_write_db()])
+            if reason is not None:
+                errors.append(checks.Warning(
+                    '{} can not keep a FTS5 index: {}.'.format(viewset.__name__, reason),
+                    hint='Searches fall back to icontains, pick another search_backend.',
+                    obj=viewset, id='popup_field.W002'))
+
+    if viewset.fast_delete:
+        opts = viewset.model._meta
+        # what the collector visits, reverse foreign keys and the tables of many to many fields included
+        visited = [related.field.model._meta.label for related in get_candidate_relations_to_delete(opts)
+                   if related.field.remote_field.on_delete is not DO_NOTHING]
+        visited.extend(field.name for field in opts.private_fields if hasattr(field, 'bulk_related_objects'))
+        if visited:
+            errors.append(checks.Warning(
+                '{} sets fast_delete but deleting {} visits {}.'.format(
+                    viewset.__name__, viewset.model.__name__, ', '.join(visited)),
+                hint='Deleting still goes through the collector, remove fast_delete or the relations.',
+                obj=viewset, id='popup_field.W001'))
+    return errors
+
+
+def check_viewsets(app_configs=None, **kwargs):
+    """
+    Validate every PopupCRUDViewSet subclass with a model at startup
+    """
+    from .views import registry
+
+    errors = []
+    for viewset in registry:
+        if app_configs is None or viewset.model._meta.app_config in app_configs:
+            errors.extend(check_viewset(viewset))
+    return errors
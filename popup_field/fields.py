@@ -1,72 +1,420 @@
+import hashlib
+
 import django
 
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.forms.renderers import get_default_renderer
 from django.forms.widgets import Select, SelectMultiple
+from django.utils.http import urlencode
+from django.utils.safestring import mark_safe
+
+try:
+    from django.forms.models import ModelChoiceIteratorValue
+except ImportError:  # django<3.1
+    ModelChoiceIteratorValue = None
 
 if django.VERSION >= (2, 0):
     from django.urls import reverse_lazy
 else:
     from django.core.urlresolvers import reverse_lazy
 
+from . import cache, metrics
+from .middleware import get_current_request
+from .permissions import get_permission_resolver
+from .render import OPTION_TEMPLATE, render_widget, uses_shipped_templates
 
-class ForeignKeyWidget(Select):
-    template_name = 'widgets/foreign_key_select.html'
+
+def get_labels_key(viewset, to_field_name=None):
+    return '{}:{}'.format(viewset.__name__, to_field_name or 'pk')
+
+
+def preload_labels(request, viewset, values, to_field_name=None):
+    """
+    Fetch the labels of values with one query and keep them in the request, the widgets of viewset rendering
+    only selected options use them instead of one query each, e.g. the rows of a changelist
+    """
+    values = {value for value in values if value not in (None, '')}
+    labels = request.__dict__.setdefault('_popup_labels', {}).setdefault(get_labels_key(viewset, to_field_name), {})
+    if not values:
+        return labels
+    queryset = viewset.get_label_queryset(viewset.model._default_manager.all(), only=(to_field_name,))
+    db = viewset.get_read_db(request)
+    if db is not None:
+        queryset = queryset.using(db)
+    for obj in queryset.filter(**{'{}__in'.format(to_field_name or 'pk'): values}):
+        labels[str(getattr(obj, to_field_name or 'pk'))] = viewset.get_label(obj)
+    return labels
+
+
+class PopupConfig(object):
+    """
+    Configuration of a popup widget, shared by every copy of the widget and never mutated:
+    setting an attribute of a widget gives the widget a new config.
+    """
+    __slots__ = ('url_template', 'popup_name', 'permissions_required', 'viewset', 'width', 'height', 'remote',
+                 'stream', 'selected_only', 'fragment', 'shared_choices', 'preload', 'fast_render', '_urls',
+                 '_fragments')
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            object.__setattr__(self, name, kwargs.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('PopupConfig is immutable, use replace()')
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return PopupConfig, (), self.__getstate__()
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__ if not name.startswith('_')}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    def replace(self, **kwargs):
+        values = self.__getstate__()
+        values.update(kwargs)
+        return PopupConfig(**values)
+
+    @property
+    def urls(self):
+        """
+        The urls of the popup views, reversed once
+        """
+        if self._urls is None:
+            url = str(self.url_template)
+            object.__setattr__(self, '_urls', {
+                'add_url': url,
+                'update_url': url,
+                'delete_url': url + 'delete/',
+                'choices_url': url + 'choices/',
+                'bulk_url': url + 'bulk/',
+                'bulk_delete_url': url + 'delete/bulk/',
+                'changes_url': url + 'changes/',
+                'export_url': url + 'export/',
+            })
+        return self._urls
+
+
+class ConfigAttribute(object):
+    """
+    Attribute of a widget kept in its PopupConfig
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, widget, owner):
+        if widget is None:
+            return self
+        return getattr(widget.config, self.name)
+
+    def __set__(self, widget, value):
+        widget.config = widget.config.replace(**{self.name: value})
+
+
+class PopupWidgetMixin(object):
+    """
+    common behaviour for ForeignKeyWidget and ManyToManyWidget.
+    The configuration lives in one shared PopupConfig, a copy of the widget for a form copies only attrs
+    and choices. The request is the one of PopupRequestMiddleware unless one is set on the widget.
+    """
+
+    class Media:
+        css = {'all': ('popup_field/popup_field.css',)}
+        js = ('popup_field/popup_field.js',)
+
+    url_template = ConfigAttribute('url_template')
+    popup_name = ConfigAttribute('popup_name')
+    permissions_required = ConfigAttribute('permissions_required')
+    # PopupCRUDViewSet which built the widget
+    viewset = ConfigAttribute('viewset')
+    width = ConfigAttribute('width')
+    height = ConfigAttribute('height')
+    # load choices on demand from the choices url instead of rendering the whole queryset
+    remote = ConfigAttribute('remote')
+    # stream every option from the export view into the select after the page is loaded
+    stream = ConfigAttribute('stream')
+    # render only the selected options, remote and stream modes always do
+    selected_only = ConfigAttribute('selected_only')
+    # load create and update forms with fetch into an inline layer instead of an iframe
+    fragment = ConfigAttribute('fragment')
+    # render the options once per request for every widget of the viewset, the runtime copies them
+    shared_choices = ConfigAttribute('shared_choices')
+    # prefetch the popups when the pointer rests on or the keyboard focuses the add and change buttons
+    preload = ConfigAttribute('preload')
+    # build the markup in python instead of the template engine, see popup_field.render
+    fast_render = ConfigAttribute('fast_render')
 
     def __init__(self, url_template, *args, **kwargs):
-        self.template_name = kwargs.pop('template_name', self.template_name)
-        self.popup_name = kwargs.pop('popup_name', '')
-        self.permissions_required = kwargs.pop('permissions_required', '')
-        self.request = kwargs.pop('request', None)
-        self.width = kwargs.pop('width', '700px')
-        self.height = kwargs.pop('height', '500px')
-        self.url_template = reverse_lazy(url_template)
-        super(ForeignKeyWidget, self).__init__(*args, **kwargs)
+        if 'template_name' in kwargs:
+            self.template_name = kwargs.pop('template_name')
+        self._request = kwargs.pop('request', None)
+        remote = kwargs.pop('remote', False)
+        stream = kwargs.pop('stream', False) and not remote
+        self.config = PopupConfig(
+            url_template=reverse_lazy(url_template),
+            popup_name=kwargs.pop('popup_name', ''),
+            permissions_required=kwargs.pop('permissions_required', {}),
+            viewset=kwargs.pop('viewset', None),
+            width=kwargs.pop('width', '700px'),
+            height=kwargs.pop('height', '500px'),
+            remote=remote,
+            stream=stream,
+            selected_only=kwargs.pop('selected_only', False) or remote or stream,
+            fragment=kwargs.pop('fragment', False),
+            shared_choices=kwargs.pop('shared_choices', False),
+            preload=kwargs.pop('preload', False),
+            fast_render=kwargs.pop('fast_render', False),
+        )
+        super(PopupWidgetMixin, self).__init__(*args, **kwargs)
 
-    def get_context(self, name, value, attrs):
-        context = super(ForeignKeyWidget, self).get_context(name, value, attrs)
-        context['popup_name'] = self.popup_name
-        context['width'] = self.width
-        context['height'] = self.height
-        context['add_url'] = self.url_template
-        context['update_url'] = self.url_template
-        context['delete_url'] = self.url_template + 'delete/'
-        if self.request is not None:
-            context['can_add'] = self.request.user.has_perms(self.permissions_required.get('create', []))
-            context['can_update'] = self.request.user.has_perms(self.permissions_required.get('update', []))
-            context['can_delete'] = self.request.user.has_perms(self.permissions_required.get('delete', []))
+    @property
+    def request(self):
+        if self._request is not None:
+            return self._request
+        return get_current_request()
+
+    @request.setter
+    def request(self, request):
+        self._request = request
+
+    def get_queryset(self):
+        """
+        Return the choice queryset shaped for the labels and sent to the read database of the viewset
+        """
+        queryset = self.choices.queryset
+        if self.viewset is not None:
+            queryset = self.viewset.get_label_queryset(queryset, only=(self.choices.field.to_field_name,))
+            db = self.viewset.get_read_db(self.request)
+            if db is not None:
+                queryset = queryset.using(db)
+        return queryset
+
+    def get_empty_choices(self):
+        """
+        Return the empty option of the field, which is never cached nor shared
+        """
+        field = self.choices.field
+        if not self.allow_multiple_selected and field.empty_label is not None:
+            return [('', field.empty_label)]
+        return []
+
+    def get_label_name(self):
+        """
+        Return the qualified name of the function building the labels, part of the keys of cached and shared choices
+        """
+        if self.viewset is not None and self.viewset.label_from_instance is not None:
+            function = self.viewset.label_from_instance
         else:
-            context['can_add'] = True
-            context['can_update'] = True
-            context['can_delete'] = True
-        return context
+            function = self.choices.field.label_from_instance
+        function = getattr(function, '__func__', function)
+        return '{}.{}'.format(getattr(function, '__module__', ''),
+                              getattr(function, '__qualname__', type(function).__qualname__))
 
+    def get_model_choices(self, value=None, empty=True):
+        """
+        Return choices of the queryset shaped by the viewset for the labels,
+        only for the selected value(s) when value is given, fetched with one pk__in query.
+        """
+        field = self.choices.field
+        choices = self.get_empty_choices() if empty else []
+        queryset = self.get_queryset()
+        try:
+            if value is not None:
+                values = [v for v in value if v not in (None, '')]
+                if not values:
+                    return choices
+                queryset = queryset.filter(**{'{}__in'.format(field.to_field_name or 'pk'): values})
+            objects = list(queryset)
+        except (ValueError, TypeError, ValidationError):
+            # bound data of an invalid form, nothing can be selected
+            objects = []
+        custom_label = self.viewset is not None and self.viewset.label_from_instance is not None
+        for obj in objects:
+            if custom_label:
+                option_value = field.prepare_value(obj)
+                if ModelChoiceIteratorValue is not None:
+                    option_value = ModelChoiceIteratorValue(option_value, obj)
+                choices.append((option_value, self.viewset.get_label(obj)))
+            else:
+                choices.append(self.choices.choice(obj))
+        return choices
 
-class ManyToManyWidget(SelectMultiple):
-    template_name = 'widgets/many_to_many_select.html'
+    def get_preloaded_labels(self):
+        """
+        Return the labels of preload_labels() for the widget, None if there are none
+        """
+        if self.viewset is None or self.request is None:
+            return None
+        return self.request.__dict__.get('_popup_labels', {}).get(
+            get_labels_key(self.viewset, self.choices.field.to_field_name))
 
-    def __init__(self, url_template, *args, **kwargs):
-        self.template_name = kwargs.pop('template_name', self.template_name)
-        self.popup_name = kwargs.pop('popup_name', '')
-        self.permissions_required = kwargs.pop('permissions_required', '')
-        self.request = kwargs.pop('request', None)
-        self.width = kwargs.pop('width', '700px')
-        self.height = kwargs.pop('height', '500px')
-        self.url_template = reverse_lazy(url_template)
-        super(ManyToManyWidget, self).__init__(*args, **kwargs)
+    def get_selected_choices(self, value):
+        """
+        Return choices only for the selected value(s), from the preloaded labels or fetched with one pk__in query.
+        """
+        labels = self.get_preloaded_labels()
+        if labels is not None:
+            values = [str(v) for v in value if v not in (None, '')]
+            if all(v in labels for v in values):
+                return self.get_empty_choices() + [(v, labels[v]) for v in values]
+        return self.get_model_choices(value)
+
+    def get_cached_choices(self):
+        """
+        Return get_model_choices() as strings from the cache of the viewset, filled on a miss.
+        The options of the rows are cached per label function, the empty option is added for the field.
+        """
+        field = self.choices.field
+        queryset = self.get_queryset()
+        key = self.viewset.get_choices_cache_key(queryset, field.to_field_name, self.get_label_name())
+        if key is None:
+            return self.get_model_choices()
+        backend = cache.get_cache(self.viewset.cache_alias)
+        choices = backend.get(key)
+        if choices is None:
+            choices = [(str(value), str(label)) for value, label in self.get_model_choices(empty=False)]
+            backend.set(key, choices, self.viewset.cache_timeout)
+        return self.get_empty_choices() + choices
+
+    def get_shared_key(self):
+        """
+        Return the key of the shared choices in the request, None if they can't be shared
+        """
+        if not self.shared_choices or self.request is None or self.viewset is None:
+            return None
+        try:
+            sql = str(self.choices.queryset.query)
+        except EmptyResultSet:
+            return None
+        field = self.choices.field
+        digest = hashlib.sha256('{}|{}|{}|{}|{}'.format(
+            sql, field.to_field_name, self.viewset.__name__, self.get_label_name(),
+            field.empty_label).encode('utf-8')).hexdigest()[:12]
+        return '{}-{}'.format(self.viewset.get_class_name(), digest)
+
+    def get_shared_choices(self, key):
+        """
+        Return {'choices': [(value, label)], 'rendered': bool} of key, evaluated once per request
+        """
+        shared = self.request.__dict__.setdefault('_popup_shared_choices', {})
+        if key not in shared:
+            choices = self.get_cached_choices() if self.viewset.cache_choices else self.get_model_choices()
+            shared[key] = {'choices': [[str(v), str(label)] for v, label in choices if str(v) != ''],
+                           'rendered': False}
+        return shared[key]
+
+    def optgroups(self, name, value, attrs=None):
+        if hasattr(self.choices, 'queryset'):
+            shared_key = self.get_shared_key() if not self.selected_only else None
+            if shared_key is not None:
+                # render only the selected options, taken from the shared choices without query
+                values = {str(v) for v in value if v not in (None, '')}
+                model_choices = [choice for choice in self.get_shared_choices(shared_key)['choices']
+                                 if choice[0] in values]
+                model_choices = self.get_empty_choices() + model_choices
+            elif self.selected_only:
+                model_choices = self.get_selected_choices(value)
+            elif self.viewset is not None and self.viewset.cache_choices:
+                model_choices = self.get_cached_choices()
+            elif self.viewset is not None and (self.viewset.shapes_labels() or self.viewset.read_db is not None):
+                model_choices = self.get_model_choices()
+            else:
+                return super(PopupWidgetMixin, self).optgroups(name, value, attrs)
+            choices = self.choices
+            self.choices = model_choices
+            try:
+                return super(PopupWidgetMixin, self).optgroups(name, value, attrs)
+            finally:
+                self.choices = choices
+        return super(PopupWidgetMixin, self).optgroups(name, value, attrs)
+
+    @property
+    def viewset_name(self):
+        return self.viewset.__name__ if self.viewset is not None else ''
+
+    def render(self, name, value, attrs=None, renderer=None):
+        if not metrics.enabled():
+            return super(PopupWidgetMixin, self).render(name, value, attrs, renderer)
+        with metrics.measure('widget.render', self.viewset_name, widget=type(self).__name__):
+            return super(PopupWidgetMixin, self).render(name, value, attrs, renderer)
+
+    def _render(self, template_name, context, renderer=None):
+        if self.fast_render:
+            if renderer is None:
+                renderer = get_default_renderer()
+            if self.option_template_name == OPTION_TEMPLATE and uses_shipped_templates(renderer, template_name):
+                return mark_safe(render_widget(self, context))
+        return super(PopupWidgetMixin, self)._render(template_name, context, renderer)
 
     def get_context(self, name, value, attrs):
-        context = super(ManyToManyWidget, self).get_context(name, value, attrs)
-        context['popup_name'] = self.popup_name
-        context['width'] = self.width
-        context['height'] = self.height
-        context['add_url'] = self.url_template
-        context['update_url'] = self.url_template
-        context['delete_url'] = self.url_template + 'delete/'
+        if not metrics.enabled():
+            return self.get_popup_context(name, value, attrs)
+        resolver = get_permission_resolver(self.request) if self.request is not None else None
+        checks = resolver.checks if resolver is not None else 0
+        with metrics.measure('widget.get_context', self.viewset_name, widget=type(self).__name__) as timer:
+            context = self.get_popup_context(name, value, attrs)
+            timer.tags['choices'] = sum(len(group[1]) for group in context['widget']['optgroups'])
+            timer.tags['permission_checks'] = resolver.checks - checks if resolver is not None else 0
+        return context
+
+    def get_popup_context(self, name, value, attrs):
+        context = super(PopupWidgetMixin, self).get_context(name, value, attrs)
+        config = self.config
+        urls = config.urls
+        context['popup_name'] = config.popup_name
+        context['width'] = config.width
+        context['height'] = config.height
+        context['add_url'] = urls['add_url']
+        context['update_url'] = urls['update_url']
+        context['delete_url'] = urls['delete_url']
+        context['remote'] = config.remote
+        context['fragment'] = config.fragment
+        # the choices and export views answer the values of to_field_name instead of the pk
+        to_field_name = self.choices.field.to_field_name if hasattr(self.choices, 'field') else None
+        context['to_field_name'] = to_field_name if config.remote and to_field_name else ''
+        context['export_url'] = urls['export_url'] if config.stream else ''
+        if context['export_url'] and to_field_name:
+            context['export_url'] += '?' + urlencode({'to_field_name': to_field_name})
+        # milliseconds a preloaded popup is reused, 0 without preload
+        context['preload'] = 0
+        if config.preload:
+            context['preload'] = (config.viewset.preload_max_age if config.viewset is not None else 10) * 1000
+        shared_key = self.get_shared_key() if not self.selected_only else None
+        if shared_key is not None:
+            shared = self.get_shared_choices(shared_key)
+            context['shared_choices_id'] = 'popup-choices-{}'.format(shared_key)
+            if not shared['rendered']:
+                # the first widget of the request renders the json of the options
+                shared['rendered'] = True
+                context['shared_choices'] = shared['choices']
+        context['choices_url'] = urls['choices_url']
+        context['bulk_url'] = urls['bulk_url']
+        context['bulk_delete_url'] = urls['bulk_delete_url']
+        if self.viewset is not None and self.viewset.change_log:
+            context['changes_url'] = urls['changes_url']
+            context['changes_token'] = cache.get_change_token(self.viewset.get_class_name())
+            context['changes_poll'] = self.viewset.change_log_poll
         if self.request is not None:
-            context['can_add'] = self.request.user.has_perms(self.permissions_required.get('create', []))
-            context['can_update'] = self.request.user.has_perms(self.permissions_required.get('update', []))
-            context['can_delete'] = self.request.user.has_perms(self.permissions_required.get('delete', []))
+            context.update(get_permission_resolver(self.request).resolve(self.permissions_required))
         else:
             context['can_add'] = True
             context['can_update'] = True
             context['can_delete'] = True
         return context
+
+
+class ForeignKeyWidget(PopupWidgetMixin, Select):
+    template_name = 'widgets/foreign_key_select.html'
+
+
+class ManyToManyWidget(PopupWidgetMixin, SelectMultiple):
+    template_name = 'widgets/many_to_many_select.html'
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from popup_field.views import registry
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search index of every PopupCRUDViewSet with search_fields'
+
+    def add_arguments(self, parser):
+        parser.add_argument('viewsets', nargs='*', help='class names of the viewsets, default is all of them')
+
+    def handle(self, *args, **options):
+        viewsets = [viewset for viewset in registry if viewset.search_fields]
+        if options['viewsets']:
+            names = set(options['viewsets'])
+            unknown = names - {viewset.__name__ for viewset in viewsets}
+            if unknown:
+                raise CommandError('Unknown viewsets or no search_fields: {}'.format(', '.join(sorted(unknown))))
+            viewsets = [viewset for viewset in viewsets if viewset.__name__ in names]
+
+        for viewset in viewsets:
+            backend = viewset.get_search_backend()
+            backend.rebuild()
+            self.stdout.write('{}: {} rebuilt'.format(viewset.__name__, type(backend).__name__))
@@ -0,0 +1,38 @@
+from django import forms
+from django.core.management.base import BaseCommand, CommandError
+
+from popup_field.cache import bump_version
+from popup_field.views import registry
+
+
+class Command(BaseCommand):
+    help = ('Fill the choices cache of the default ForeignKey and ManyToManyField widgets of every PopupCRUDViewSet '
+            'with cache_choices = True')
+
+    def add_arguments(self, parser):
+        parser.add_argument('viewsets', nargs='*', help='class names of the viewsets, default is all of them')
+        parser.add_argument('--no-invalidate', action='store_false', dest='invalidate',
+                            help='keep the cached choices instead of bumping the version first')
+
+    def handle(self, *args, **options):
+        viewsets = [viewset for viewset in registry if viewset.cache_choices]
+        if options['viewsets']:
+            names = set(options['viewsets'])
+            unknown = names - {viewset.__name__ for viewset in viewsets}
+            if unknown:
+                raise CommandError('Unknown viewsets or cache_choices is False: {}'.format(', '.join(sorted(unknown))))
+            viewsets = [viewset for viewset in viewsets if viewset.__name__ in names]
+
+        for viewset in viewsets:
+            if options['invalidate']:
+                bump_version(viewset.model)
+            # the options of fields with the default queryset and labels, other fields fill the cache when rendered
+            queryset = viewset.model._default_manager.all()
+            fields = (
+                ('ForeignKey', forms.ModelChoiceField(queryset=queryset, widget=viewset.get_fk_popup_field())),
+                ('ManyToManyField', forms.ModelMultipleChoiceField(queryset=queryset,
+                                                                   widget=viewset.get_m2m_popup_field())),
+            )
+            for kind, field in fields:
+                count = len([value for value, label in field.widget.get_cached_choices() if value != ''])
+                self.stdout.write('{} {}: {} choices cached'.format(viewset.__name__, kind, count))
@@ -0,0 +1,144 @@
+"""
+Instrumentation of popup widgets and views.
+
+Every measured operation is sent to the backends listed in POPUP_METRICS_BACKENDS and to the popup_metric
+signal, with its name ('widget.get_context', 'widget.render', 'view.create', ...), the class name of the
+viewset, the seconds and the queries it took and some tags. Nothing is measured without backend or receiver.
+"""
+import logging
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections
+from django.dispatch import Signal, receiver
+from django.utils.module_loading import import_string
+
+# sent with name, viewset and data for every measured operation
+popup_metric = Signal()
+
+_backends = None
+_extra_backends = []
+
+
+class LoggingBackend(object):
+    """
+    Log every metric to the popup_field.metrics logger
+    """
+
+    def __init__(self, logger='popup_field.metrics', level=logging.INFO):
+        self.logger = logging.getLogger(logger)
+        self.level = level
+
+    def record(self, name, viewset, data):
+        self.logger.log(self.level, '%s %s %s', name, viewset,
+                        ' '.join('{}={}'.format(key, value) for key, value in sorted(data.items())))
+
+
+class MemoryBackend(object):
+    """
+    Keep every metric in memory and aggregate them, for tests
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def record(self, name, viewset, data):
+        self.events.append((name, viewset, data))
+
+    def clear(self):
+        del self.events[:]
+
+    def summary(self):
+        """
+        Return {(name, viewset): {'count': ..., 'seconds': ..., 'queries': ...}}
+        """
+        summary = defaultdict(lambda: {'count': 0, 'seconds': 0.0, 'queries': 0})
+        for name, viewset, data in self.events:
+            item = summary[(name, viewset)]
+            item['count'] += 1
+            item['seconds'] += data.get('seconds', 0.0)
+            item['queries'] += data.get('queries') or 0
+        return dict(summary)
+
+
+def get_backends():
+    global _backends
+    if _backends is None:
+        _backends = [import_string(path)() for path in getattr(settings, 'POPUP_METRICS_BACKENDS', [])]
+    return _backends + _extra_backends
+
+
+def add_backend(backend):
+    """
+    Register a backend instance at runtime, e.g. a MemoryBackend in tests
+    """
+    _extra_backends.append(backend)
+    return backend
+
+
+def remove_backend(backend):
+    _extra_backends.remove(backend)
+
+
+@receiver(setting_changed)
+def reset_backends(setting, **kwargs):
+    global _backends
+    if setting == 'POPUP_METRICS_BACKENDS':
+        _backends = None
+
+
+def enabled():
+    return bool(get_backends()) or popup_metric.has_listeners()
+
+
+def record(name, viewset, **data):
+    for backend in get_backends():
+        backend.record(name, viewset, data)
+    popup_metric.send(sender=None, name=name, viewset=viewset, data=data)
+
+
+class Timer(object):
+    """
+    Measure the seconds from creation to stop() and count the queries run inside count_queries()
+    """
+
+    def __init__(self, name, viewset, **tags):
+        self.name = name
+        self.viewset = viewset
+        self.tags = tags
+        self.queries = 0
+        self.start = time.perf_counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def count_queries(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                if hasattr(connection, 'execute_wrapper'):
+                    stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    def stop(self, **tags):
+        self.tags.update(tags)
+        record(self.name, self.viewset, seconds=time.perf_counter() - self.start, queries=self.queries, **self.tags)
+
+
+@contextmanager
+def measure(name, viewset, **tags):
+    """
+    Measure the block, the yielded Timer accepts more tags
+    """
+    timer = Timer(name, viewset, **tags)
+    with timer.count_queries():
+        try:
+            yield timer
+        except Exception as e:
+            timer.stop(error=type(e).__name__)
+            raise
+    timer.stop()
@@ -0,0 +1,46 @@
+"""
+Make the current request available to the popup widgets without storing it on them.
+"""
+from contextvars import ContextVar
+
+try:
+    from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+except ImportError:  # asgiref<3.6
+    iscoroutinefunction = markcoroutinefunction = None
+
+_request = ContextVar('popup_field_request', default=None)
+
+
+def get_current_request():
+    return _request.get()
+
+
+class PopupRequestMiddleware(object):
+    """
+    Keep the request in a context variable while the response is built and rendered,
+    per thread and per async task
+    """
+    sync_capable = True
+    async_capable = markcoroutinefunction is not None
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = self.async_capable and iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = _request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _request.reset(token)
+
+    async def __acall__(self, request):
+        token = _request.set(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            _request.reset(token)
@@ -0,0 +1,47 @@
+ACTIONS = (
+    ('can_add', 'create'),
+    ('can_update', 'update'),
+    ('can_delete', 'delete'),
+)
+
+
+class PermissionResolver(object):
+    """
+    Resolve can_add、can_update and can_delete for one request, each set of
+    permissions_required is checked against the user only once
+    """
+
+    def __init__(self, user):
+        self.user = user
+        # has_perms calls made
+        self.checks = 0
+        # has_perms calls answered from the cache
+        self.skipped = 0
+        self._cache = {}
+
+    @staticmethod
+    def get_key(permissions_required):
+        return tuple(tuple(permissions_required.get(action, [])) for name, action in ACTIONS)
+
+    def resolve(self, permissions_required):
+        key = self.get_key(permissions_required or {})
+        if key in self._cache:
+            self.skipped += len(ACTIONS)
+            return self._cache[key]
+        flags = {}
+        for (name, action), perms in zip(ACTIONS, key):
+            flags[name] = self.user.has_perms(perms)
+            self.checks += 1
+        self._cache[key] = flags
+        return flags
+
+
+def get_permission_resolver(request):
+    """
+    Return the PermissionResolver bound to request, create it at first use
+    """
+    resolver = getattr(request, '_popup_permission_resolver', None)
+    if resolver is None:
+        resolver = PermissionResolver(request.user)
+        request._popup_permission_resolver = resolver
+    return resolver
@@ -0,0 +1,195 @@
+"""
+Render ForeignKeyWidget and ManyToManyWidget without the template engine.
+
+The markup of widgets/foreign_key_select.html、widgets/many_to_many_select.html and of the select, option and
+attrs templates of django is built in python from the context of the widget, byte for byte. The attributes of the
+container which only depend on the viewset are escaped once per config and language. A renderer whose templates
+are not the shipped ones, e.g. overridden by the project or jinja2, keeps the template engine.
+"""
+import os
+
+import django
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template import Context
+from django.template.base import render_value_in_context
+from django.utils.html import json_script
+from django.utils.safestring import SafeData
+from django.utils.translation import get_language
+
+POPUP_TEMPLATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+DJANGO_TEMPLATES = os.path.join(os.path.dirname(os.path.abspath(django.__file__)), 'forms', 'templates')
+
+OPTION_TEMPLATE = 'django/forms/widgets/select_option.html'
+SHIPPED_TEMPLATES = {
+    'widgets/foreign_key_select.html': POPUP_TEMPLATES,
+    'widgets/many_to_many_select.html': POPUP_TEMPLATES,
+    'django/forms/widgets/select.html': DJANGO_TEMPLATES,
+    OPTION_TEMPLATE: DJANGO_TEMPLATES,
+    'django/forms/widgets/attrs.html': DJANGO_TEMPLATES,
+}
+
+_context = Context()
+# {(renderer class, template name): bool}
+_renderers = {}
+
+
+@receiver(setting_changed)
+def reset_renderers(setting, **kwargs):
+    if setting in ('TEMPLATES', 'FORM_RENDERER'):
+        _renderers.clear()
+
+
+def uses_shipped_templates(renderer, template_name):
+    """
+    Whether renderer loads template_name and the templates it includes from popup_field and django
+    """
+    key = (type(renderer), template_name)
+    if key not in _renderers:
+        shipped = SHIPPED_TEMPLATES.get(template_name) == POPUP_TEMPLATES
+        for name in (template_name, 'django/forms/widgets/select.html', OPTION_TEMPLATE,
+                     'django/forms/widgets/attrs.html'):
+            if not shipped:
+                break
+            try:
+                origin = renderer.get_template(name).origin.name
+            except Exception:
+                shipped = False
+            else:
+                shipped = origin == os.path.join(SHIPPED_TEMPLATES[name], *name.split('/'))
+        _renderers[key] = shipped
+    return _renderers[key]
+
+
+def value(obj):
+    """
+    {{ obj }}
+    """
+    return render_value_in_context(obj, _context)
+
+
+def stringformat(obj):
+    """
+    {{ obj|stringformat:'s' }}
+    """
+    if isinstance(obj, tuple):
+        obj = str(obj)
+    text = '%s' % obj
+    if isinstance(obj, SafeData):
+        return str(obj)
+    return value(text)
+
+
+def attrs(items):
+    """
+    django/forms/widgets/attrs.html
+    """
+    html = []
+    for name, obj in items.items():
+        if obj is not False:
+            html.append(' ' + value(name))
+            if obj is not True:
+                html.append('="' + stringformat(obj) + '"')
+    return ''.join(html)
+
+
+def select(widget):
+    """
+    django/forms/widgets/select.html, ending with its newline
+    """
+    html = ['<select name="', value(widget['name']), '"', attrs(widget['attrs']), '>']
+    for group_name, group_choices, group_index in widget['optgroups']:
+        if group_name:
+            html.append('\n  <optgroup label="' + value(group_name) + '">')
+        for option in group_choices:
+            html.append('\n  <option value="' + stringformat(option['value']) + '"' + attrs(option['attrs']) +
+                        '>' + value(option['label']) + '</option>\n')
+        if group_name:
+            html.append('\n  </optgroup>')
+    html.append('\n</select>\n')
+    return ''.join(html)
+
+
+def get_static(config, multiple):
+    """
+    Return the escaped attributes of the container which only depend on config, once per language
+    """
+    key = (get_language(), multiple)
+    fragments = config._fragments
+    if fragments is None:
+        fragments = {}
+        object.__setattr__(config, '_fragments', fragments)
+    if key not in fragments:
+        urls = config.urls
+        head = ['" data-popup-name="', value(config.popup_name), '"\n     data-width="', value(config.width),
+                '" data-height="', value(config.height), '" data-add-url="', value(urls['add_url']),
+                '"\n     data-update-url="', value(urls['update_url']), '" data-delete-url="',
+                value(urls['delete_url']), '"']
+        if multiple:
+            head.extend([' data-bulk-url="', value(urls['bulk_url']), '"\n     data-bulk-delete-url="',
+                         value(urls['bulk_delete_url']), '"'])
+        if config.remote:
+            head.extend(['\n     data-choices-url="', value(urls['choices_url']), '"'])
+        if config.fragment:
+            head.append(' data-fragment="1"')
+        fragments[key] = {
+            'head': ''.join(head),
+            'search': '\n        <input type="text" class="layui-input" data-popup-search placeholder="搜索' +
+                      value(config.popup_name) + '" autocomplete="off">\n    ',
+        }
+    return fragments[key]
+
+
+def render_widget(widget, context):
+    """
+    Return the markup of the template of widget for context, as the template engine renders it
+    """
+    multiple = widget.allow_multiple_selected
+    static = get_static(widget.config, multiple)
+    widget_id = value(context['widget']['attrs'].get('id', ''))
+    preload = context.get('preload')
+    tabindex = ' tabindex="0"' if preload else ''
+    html = ['<div class="popup-field" data-popup-field="', widget_id, static['head']]
+    if context.get('to_field_name'):
+        html.append(' data-to-field-name="' + value(context['to_field_name']) + '"')
+    if preload:
+        html.append(' data-preload="' + value(preload) + '"')
+    if context.get('export_url'):
+        html.append(' data-export-url="' + value(context['export_url']) + '"')
+    if context.get('changes_url'):
+        html.append('\n     data-changes-url="' + value(context['changes_url']) + '" data-changes-token="' +
+                    value(context['changes_token']) + '"\n     data-changes-poll="' +
+                    value(context['changes_poll']) + '"')
+    if context.get('shared_choices_id'):
+        html.append('\n     data-shared-choices="' + value(context['shared_choices_id']) + '"')
+    html.append('>\n    ')
+    if context.get('shared_choices'):
+        html.append(value(json_script(context['shared_choices'], context['shared_choices_id'])))
+    html.append('\n    ')
+    if context.get('remote'):
+        html.append(static['search'])
+    html.extend(['\n    ', select(context['widget']), '\n    '])
+    if context.get('remote'):
+        html.append('\n        <a class="layui-btn layui-btn-mini layui-btn-primary" data-popup-action="more" '
+                    'style="display: none">加载更多</a>\n    ')
+    html.append('\n\n    <div class="layui-btn-group">\n        ')
+    if context.get('can_add'):
+        if multiple:
+            html.extend(['\n            <a class="layui-btn layui-btn-mini" id="', widget_id,
+                         '_add" data-popup-action="add"', tabindex, '>新增</a>\n'
+                         '            <a class="layui-btn layui-btn-mini" id="', widget_id,
+                         '_bulk" data-popup-action="bulk">批量新增</a>\n        '])
+        else:
+            html.extend(['<a class="layui-btn layui-btn-mini" id="', widget_id, '_add" data-popup-action="add"',
+                         tabindex, '>新增</a>'])
+    html.append('\n        ')
+    if context.get('can_update'):
+        html.extend(['\n            <a class="layui-btn layui-btn-mini layui-btn-disabled layui-btn-normal" id="',
+                     widget_id, '_change"\n               data-popup-action="change"', tabindex,
+                     '>修改</a>\n        '])
+    html.append('\n        ')
+    if context.get('can_delete'):
+        html.extend(['\n            <a class="layui-btn layui-btn-mini layui-btn-disabled layui-btn-danger" id="',
+                     widget_id, '_delete"\n               data-popup-action="delete">删除</a>\n        '])
+    html.append('\n    </div>\n</div>')
+    return ''.join(html)
@@ -0,0 +1,237 @@
+"""
+Search backends of the choices view.
+
+A backend filters a queryset of the viewset by the text typed in the widget and keeps its index in sync with
+the rows. The post_save and post_delete receivers call changed() with the database of the write, the bulk create
+view calls it for the rows of bulk_create which sends no signal.
+"""
+import functools
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections, models, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+
+
+class ORMSearchBackend(object):
+    """
+    Filter search_fields with lookup, no index
+    """
+    lookup = 'icontains'
+
+    def __init__(self, viewset):
+        self.viewset = viewset
+        self.model = viewset.model
+        self.fields = tuple(viewset.search_fields)
+
+    def search(self, queryset, q):
+        condition = Q()
+        for field in self.fields:
+            condition |= Q(**{'{}__{}'.format(field, self.lookup): q})
+        return queryset.filter(condition)
+
+    def get_write_db(self):
+        return self.viewset.write_db or router.db_for_write(self.model)
+
+    def changed(self, op, pks, using=None):
+        """
+        Update the index of database using after a write, op is create、update or delete
+        """
+
+    def rebuild(self):
+        """
+        Build the index from scratch
+        """
+
+    def connect(self):
+        """
+        Keep the index in sync with post_save and post_delete
+        """
+
+    def disconnect(self):
+        """
+        Undo connect()
+        """
+
+
+class PrefixSearchBackend(ORMSearchBackend):
+    """
+    Match the beginning of search_fields, an index on the fields is used by most databases
+    """
+    lookup = 'istartswith'
+
+
+@functools.lru_cache(maxsize=None)
+def has_trigram(tokenize='trigram'):
+    """
+    Whether the sqlite library of python, the one of every sqlite database of django, has FTS5 with tokenize
+    """
+    if sqlite3 is None:
+        return False
+    connection = sqlite3.connect(':memory:')
+    try:
+        connection.execute("CREATE VIRTUAL TABLE probe USING fts5(text, tokenize='{}')".format(tokenize))
+    except sqlite3.Error:
+        return False
+    finally:
+        connection.close()
+    return True
+
+
+class SQLiteFTS5SearchBackend(ORMSearchBackend):
+    """
+    Search a FTS5 table of search_fields with the trigram tokenizer (sqlite>=3.34), which matches substrings
+    like icontains. The table is created and filled on first use, queries shorter than 3 characters and other
+    databases fall back to icontains, as a viewset the index can't serve (see get_unsupported_reason()).
+    """
+    tokenize = 'trigram'
+    min_length = 3
+
+    def __init__(self, viewset):
+        super(SQLiteFTS5SearchBackend, self).__init__(viewset)
+        self.table = 'popup_fts_{}_{}'.format(self.model._meta.db_table, viewset.get_class_name())
+        self.columns = []
+        for field in self.fields:
+            try:
+                self.columns.append(self.model._meta.get_field(field).column)
+            except FieldDoesNotExist:
+                self.columns = None
+                break
+        self.ready = set()
+
+    def has_integer_pk(self):
+        pk = self.model._meta.pk
+        if pk.remote_field is not None:
+            pk = pk.target_field
+        return isinstance(pk, (models.AutoField, models.IntegerField))
+
+    def get_unsupported_reason(self, connection=None):
+        """
+        Return why the index can't be kept, in connection when given, None if it can.
+        The rowid of the index is the primary key and the trigram tokenizer needs sqlite>=3.34 with FTS5.
+        """
+        if not self.fields:
+            return 'no search_fields'
+        if not self.columns:
+            return 'search_fields are not columns of {}'.format(self.model.__name__)
+        if not self.has_integer_pk():
+            return 'the primary key of {} is not an integer'.format(self.model.__name__)
+        if connection is not None and connection.vendor == 'sqlite' and not has_trigram(self.tokenize):
+            return 'sqlite of {} has no FTS5 with the {} tokenizer'.format(connection.alias, self.tokenize)
+        return None
+
+    def get_connection(self, using=None):
+        """
+        Return the connection keeping the index, None to fall back to icontains
+        """
+        connection = connections[using or self.get_write_db()]
+        if connection.vendor != 'sqlite' or self.get_unsupported_reason(connection) is not None:
+            return None
+        return connection
+
+    def ensure_table(self, connection):
+        if connection.alias in self.ready:
+            return
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            if self.table not in connection.introspection.table_names(cursor):
+                cursor.execute('CREATE VIRTUAL TABLE {} USING fts5({}, tokenize={})'.format(
+                    quote(self.table), ', '.join(quote(column) for column in self.columns),
+                    "'{}'".format(self.tokenize)))
+                self.fill(cursor, connection)
+        self.ready.add(connection.alias)
+
+    def fill(self, cursor, connection, pks=None):
+        quote = connection.ops.quote_name
+        sql = 'INSERT INTO {} (rowid, {}) SELECT {}, {} FROM {}'.format(
+            quote(self.table), ', '.join(quote(column) for column in self.columns),
+            quote(self.model._meta.pk.column), ', '.join(quote(column) for column in self.columns),
+            quote(self.model._meta.db_table))
+        if pks is None:
+            cursor.execute(sql)
+        elif pks:
+            cursor.execute('{} WHERE {} IN ({})'.format(sql, quote(self.model._meta.pk.column),
+                                                        ', '.join(['%s'] * len(pks))), list(pks))
+
+    def remove(self, cursor, connection, pks):
+        if pks:
+            cursor.execute('DELETE FROM {} WHERE rowid IN ({})'.format(
+                connection.ops.quote_name(self.table), ', '.join(['%s'] * len(pks))), list(pks))
+
+    def search(self, queryset, q):
+        connection = self.get_connection(queryset.db)
+        if connection is None or len(q) < self.min_length:
+            return super(SQLiteFTS5SearchBackend, self).search(queryset, q)
+        self.ensure_table(connection)
+        quoted = connection.ops.quote_name(self.table)
+        match = '"{}"'.format(q.replace('"', '""'))
+        return queryset.filter(pk__in=RawSQL('SELECT rowid FROM {} WHERE {} MATCH %s'.format(quoted, quoted),
+                                             [match]))
+
+    def changed(self, op, pks, using=None):
+        connection = self.get_connection(using)
+        if connection is None:
+            return
+        self.ensure_table(connection)
+        with connection.cursor() as cursor:
+            self.remove(cursor, connection, pks)
+            if op != 'delete':
+                self.fill(cursor, connection, pks)
+
+    def rebuild(self):
+        connection = self.get_connection()
+        if connection is None:
+            return
+        self.ready.discard(connection.alias)
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS {}'.format(connection.ops.quote_name(self.table)))
+        self.ensure_table(connection)
+
+    def saved(self, sender, instance, using=None, **kwargs):
+        self.changed('update', [instance.pk], using)
+
+    def deleted(self, sender, instance, using=None, **kwargs):
+        self.changed('delete', [instance.pk], using)
+
+    def get_dispatch_uid(self):
+        return 'popup_field_fts_{}_{}'.format(self.model._meta.label_lower, self.viewset.__name__)
+
+    def connect(self):
+        if self.get_unsupported_reason() is not None:
+            return
+        uid = self.get_dispatch_uid()
+        post_save.connect(self.saved, sender=self.model, weak=False, dispatch_uid=uid)
+        post_delete.connect(self.deleted, sender=self.model, weak=False, dispatch_uid=uid)
+
+    def disconnect(self):
+        uid = self.get_dispatch_uid()
+        post_save.disconnect(sender=self.model, dispatch_uid=uid)
+        post_delete.disconnect(sender=self.model, dispatch_uid=uid)
+
+
+class PostgresTrigramSearchBackend(ORMSearchBackend):
+    """
+    icontains backed by GIN trigram indexes of pg_trgm, created by rebuild() or by a migration,
+    postgres keeps them in sync.
+    """
+
+    def get_index_name(self, column):
+        return 'popup_trgm_{}_{}'.format(self.model._meta.db_table, column)[:63]
+
+    def rebuild(self):
+        connection = connections[self.get_write_db()]
+        if connection.vendor != 'postgresql':
+            return
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for field in self.fields:
+                column = self.model._meta.get_field(field).column
+                cursor.execute('CREATE INDEX IF NOT EXISTS {} ON {} USING gin (UPPER({}::text) gin_trgm_ops)'.format(
+                    quote(self.get_index_name(column)), quote(self.model._meta.db_table), quote(column)))
@@ -0,0 +1,685 @@
+/*
+ * django-popup-field runtime
+ * loaded once per page through the widget Media, every widget is bound by event delegation on its
+ * data-popup-field container: <div data-popup-field="{select id}" data-add-url=... data-update-url=...>
+ */
+(function (window, document) {
+    'use strict';
+
+    var script = document.currentScript;
+    var staticRoot = script ? script.src.replace(/popup_field\/popup_field(\.\w+)?\.js(\?.*)?$/, '') : '/static/';
+
+    function loadScript(src, callback) {
+        var element = document.createElement('script');
+        element.src = src;
+        element.onload = callback;
+        document.head.appendChild(element);
+    }
+
+    function getCookie(name) {
+        var match = document.cookie.match(new RegExp('(?:^|;\\s*)' + name + '=([^;]*)'));
+        return match ? decodeURIComponent(match[1]) : null;
+    }
+
+    /********保证jQuery和layer已加载**********/
+    function ensure(callback) {
+        if (!window.jQuery) {
+            loadScript(staticRoot + 'jquery/jquery-2.1.3.min.js', function () {
+                ensure(callback);
+            });
+        } else if (!window.layer) {
+            if (typeof window.layui !== 'undefined') {
+                window.layui.use('layer', function () {
+                    window.layer = window.layui.layer;
+                    callback(window.jQuery);
+                });
+            } else {
+                loadScript(staticRoot + 'layer/layer.js', function () {
+                    callback(window.jQuery);
+                });
+            }
+        } else {
+            callback(window.jQuery);
+        }
+    }
+
+    function start($) {
+        var popupField = {};
+
+        function container(id) {
+            return $('[data-popup-field="' + id + '"]');
+        }
+
+        function select(id) {
+            return $(document.getElementById(id));
+        }
+
+        function option(id, pk) {
+            return select(id).find('option').filter(function () {
+                return this.value === String(pk);
+            });
+        }
+
+        function selected(id) {
+            var value = select(id).val();
+            if ($.isArray(value)) {
+                return value.length === 1 ? value[0] : null;
+            }
+            return value || null;
+        }
+
+        function selectedAll(id) {
+            var value = select(id).val();
+            if ($.isArray(value)) {
+                return value;
+            }
+            return value ? [value] : [];
+        }
+
+        /********共享选项 控件只渲染已选项 其余选项在第一次使用时从页面中的json复制**********/
+        var sharedOptions = {};
+
+        function sharedFragment(key) {
+            if (!sharedOptions[key]) {
+                var fragment = document.createDocumentFragment(), element = document.getElementById(key);
+                $.each(element ? JSON.parse(element.textContent) : [], function (i, choice) {
+                    var node = document.createElement('option');
+                    node.value = choice[0];
+                    node.textContent = choice[1];
+                    fragment.appendChild(node);
+                });
+                sharedOptions[key] = fragment;
+            }
+            return sharedOptions[key];
+        }
+
+        popupField.fill = function (id) {
+            var $field = container(id), key = $field.data('shared-choices'), element = document.getElementById(id);
+            if (!key || !element || $field.data('popup-filled')) {
+                return;
+            }
+            $field.data('popup-filled', true);
+            var fragment = sharedFragment(key).cloneNode(true), values = {}, chosen = {};
+            $.each(fragment.childNodes, function (i, node) {
+                values[node.value] = true;
+            });
+            $(element).find('option').each(function () {
+                if (values[this.value]) {
+                    chosen[this.value] = this.selected;
+                    $(this).remove();
+                }
+            });
+            $.each(fragment.childNodes, function (i, node) {
+                node.selected = !!chosen[node.value];
+            });
+            element.appendChild(fragment);
+        };
+
+        /********如果select有且只有一个选中值，就可修改及删除；支持批量删除时选中多个也可删除**********/
+        popupField.refresh = function (id) {
+            var $field = container(id), count = selectedAll(id).length;
+            $field.find('[data-popup-action="change"]').toggleClass('layui-btn-disabled', !selected(id));
+            $field.find('[data-popup-action="delete"]').toggleClass('layui-btn-disabled',
+                $field.data('bulk-delete-url') ? count === 0 : !selected(id));
+        };
+
+        popupField.frame = function (id, title, url) {
+            var $field = container(id);
+            layer.open({
+                title: title,
+                type: 2,
+                area: [$field.data('width'), $field.data('height')],
+                content: url,
+                success: function () {
+                    popupField.refresh(id);
+                }
+            });
+        };
+
+        function fetchFragment(url, headers) {
+            return fetch(url + '&fragment=1', {
+                credentials: 'same-origin',
+                headers: $.extend({'X-Requested-With': 'XMLHttpRequest'}, headers)
+            }).then(function (response) {
+                if (!response.ok) {
+                    throw new Error(response.status);
+                }
+                return response.text();
+            });
+        }
+
+        function usesFragment($field) {
+            return $field.data('fragment') && window.fetch && window.FormData;
+        }
+
+        /********预加载 指针停留或键盘聚焦新增、修改按钮时提前请求弹窗 点击时复用 只用一次**********/
+        var preloaded = {};
+
+        function takePreloaded(url) {
+            var entry = preloaded[url];
+            delete preloaded[url];
+            return entry && entry.expires > Date.now() ? entry : null;
+        }
+
+        popupField.preload = function (id, action) {
+            var $field = container(id), url = popupField.url(id, action), entry = preloaded[url];
+            var connection = navigator.connection;
+            if (!url || (entry && entry.expires > Date.now()) || (connection && connection.saveData)) {
+                return;
+            }
+            entry = {expires: Date.now() + $field.data('preload')};
+            if (usesFragment($field)) {
+                entry.html = fetchFragment(url, {'Purpose': 'prefetch'});
+                entry.html.catch(function () {
+                    if (preloaded[url] === entry) {
+                        delete preloaded[url];
+                    }
+                });
+            } else {
+                // 浏览器带Sec-Purpose预取 iframe打开时从缓存读取
+                var link = document.createElement('link');
+                link.rel = 'prefetch';
+                link.href = url;
+                document.head.appendChild(link);
+            }
+            preloaded[url] = entry;
+        };
+
+        /********data-fragment时用fetch加载表单到页面层 不建新的页面 失败时退回iframe**********/
+        popupField.open = function (id, title, url) {
+            var $field = container(id), entry = takePreloaded(url);
+            if (!usesFragment($field)) {
+                popupField.frame(id, title, url);
+                return;
+            }
+            (entry && entry.html ? entry.html : fetchFragment(url)).then(function (html) {
+                var $fragment = $('<div>').attr('data-popup-fragment', id).html(html);
+                var index = layer.open({
+                    title: title,
+                    type: 1,
+                    area: [$field.data('width'), $field.data('height')],
+                    content: $fragment
+                });
+                $fragment.data('layer-index', index);
+            }, function () {
+                popupField.frame(id, title, url);
+            });
+        };
+
+        /********新增、修改弹窗的地址 修改时需要有且只有一个选中值**********/
+        popupField.url = function (id, action) {
+            var $field = container(id), pk;
+            if (action === 'add') {
+                return $field.data('add-url') + '?to_field=' + id;
+            }
+            pk = selected(id);
+            return action === 'change' && pk ? $field.data('update-url') + pk + '/?to_field=' + id : null;
+        };
+
+        popupField.add = function (id) {
+            var $field = container(id);
+            popupField.open(id, '添加' + $field.data('popup-name'), popupField.url(id, 'add'));
+        };
+
+        /********批量新增 每行一个**********/
+        popupField.bulk = function (id) {
+            var $field = container(id);
+            layer.prompt({formType: 2, title: '批量新增' + $field.data('popup-name') + ' (每行一个)'}, function (text, index) {
+                $.ajax({
+                    type: 'POST',
+                    data: {names: text},
+                    url: $field.data('bulk-url') + '?to_field=' + id,
+                    beforeSend: function (xhr) {
+                        xhr.setRequestHeader('X-CSRFToken', getCookie('csrftoken'));
+                    },
+                    success: function (data) {
+                        layer.close(index);
+                        popupField.complete(data);
+                    },
+                    error: function (XMLHttpRequest) {
+                        layer.alert('新增失败 ' + XMLHttpRequest.responseText);
+                    }
+                });
+            });
+        };
+
+        popupField.change = function (id) {
+            var $field = container(id), url = popupField.url(id, 'change');
+            if (url) {
+                popupField.open(id, '修改' + $field.data('popup-name'), url);
+            }
+        };
+
+        popupField.delete = function (id) {
+            var $field = container(id), pk = selected(id);
+            if (!pk) {
+                if ($field.data('bulk-delete-url') && selectedAll(id).length > 1) {
+                    popupField.bulkDelete(id);
+                }
+                return;
+            }
+            var value = option(id, pk).text();
+            var indexGood = value.lastIndexOf('>');
+            var valueN = indexGood > 0 ? value.substring(indexGood + 1, value.length) : value;
+            layer.confirm('确认删除 ' + valueN + ' 吗?', {icon: 3, title: '删除' + $field.data('popup-name')}, function (index) {
+                $.ajax({
+                    type: 'POST',
+                    data: {},
+                    url: $field.data('delete-url') + pk + '/',
+                    beforeSend: function (xhr) {
+                        xhr.setRequestHeader('X-CSRFToken', getCookie('csrftoken'));
+                    },
+                    success: function (data) {
+                        // 关闭弹窗 返回列表
+                        layer.close(index);
+                        data.to_field = id;
+                        popupField.complete(data);
+                    },
+                    error: function (XMLHttpRequest) {
+                        layer.alert('删除失败 ' + XMLHttpRequest.responseText);
+                    }
+                });
+            });
+        };
+
+        /********应用新增、修改、删除的结果 data: {op, id, value, to_field}**********/
+        popupField.complete = function (data, source) {
+            var id = data.to_field;
+            if (source && source.name) {
+                // 关闭结果所在的弹窗
+                layer.close(layer.getFrameIndex(source.name));
+            }
+            if (!id || !(data.id || data.results)) {
+                return;
+            }
+            popupField.forget(id);
+            popupField.fill(id);
+            switch (data.op) {
+                case 'create':
+                    select(id).append($('<option>').val(data.id).text(data.value).prop('selected', true));
+                    break;
+                case 'update':
+                    option(id, data.id).text(data.value);
+                    break;
+                case 'delete':
+                    option(id, data.id).remove();
+                    break;
+                case 'bulk_delete':
+                    $.each(data.results, function (i, item) {
+                        option(id, item.id).remove();
+                    });
+                    break;
+                case 'bulk_create':
+                    var $select = select(id);
+                    $.each(data.results, function (i, item) {
+                        $select.append($('<option>').val(item.id).text(item.value).prop('selected', true));
+                    });
+                    break;
+            }
+            popupField.refresh(id);
+        };
+
+        window.addEventListener('message', function (event) {
+            if (event.origin === window.location.origin && event.data && event.data.popupField) {
+                popupField.complete(event.data.popupField, event.source);
+            }
+        });
+
+        /********批量删除选中的多个值 一次确认一次请求**********/
+        popupField.bulkDelete = function (id) {
+            var $field = container(id), pks = selectedAll(id);
+            layer.confirm('确认删除选中的 ' + pks.length + ' 个' + $field.data('popup-name') + ' 吗?', {
+                icon: 3,
+                title: '删除' + $field.data('popup-name')
+            }, function (index) {
+                $.ajax({
+                    type: 'POST',
+                    data: {pk: pks},
+                    traditional: true,
+                    url: $field.data('bulk-delete-url') + '?to_field=' + id,
+                    beforeSend: function (xhr) {
+                        xhr.setRequestHeader('X-CSRFToken', getCookie('csrftoken'));
+                    },
+                    success: function (data) {
+                        layer.close(index);
+                        popupField.complete(data);
+                    },
+                    error: function (XMLHttpRequest) {
+                        layer.alert('删除失败 ' + XMLHttpRequest.responseText);
+                    }
+                });
+            });
+        };
+
+        /********远程选项的查询结果按地址和参数记在页面中 新增、修改、删除后清空**********/
+        var searchMemo = {}, memoKeys = [], MEMO_SIZE = 200, SEARCH_DELAY = 250;
+
+        /********选项请求的参数 外键指向非主键字段时带上to_field_name**********/
+        function choiceParams($field, q) {
+            var params = {q: q};
+            if ($field.data('to-field-name')) {
+                params.to_field_name = $field.data('to-field-name');
+            }
+            return params;
+        }
+
+        function memoKey(url, params) {
+            return url + '?' + $.param(params);
+        }
+
+        function remember(key, data) {
+            if (!searchMemo.hasOwnProperty(key)) {
+                memoKeys.push(key);
+                if (memoKeys.length > MEMO_SIZE) {
+                    delete searchMemo[memoKeys.shift()];
+                }
+            }
+            searchMemo[key] = data;
+        }
+
+        popupField.forget = function (id) {
+            var url = container(id).data('choices-url');
+            if (!url) {
+                return;
+            }
+            memoKeys = $.grep(memoKeys, function (key) {
+                if (key.indexOf(url + '?') === 0) {
+                    delete searchMemo[key];
+                    return false;
+                }
+                return true;
+            });
+        };
+
+        /********远程加载选项 保留已选中项 按主键分页 新的请求取消未完成的请求**********/
+        popupField.load = function (id, reset) {
+            var $field = container(id), state = $field.data('popup-state') || {q: '', next: null};
+            var url = $field.data('choices-url'), params = choiceParams($field, state.q), key, xhr;
+            if (!reset && state.next !== null) {
+                params.after = state.next;
+            }
+            if (state.xhr) {
+                state.xhr.abort();
+                state.xhr = null;
+            }
+            key = memoKey(url, params);
+
+            function show(data) {
+                var $select = select(id);
+                if (reset) {
+                    $select.find('option:not(:selected)').filter(function () {
+                        return this.value !== '';
+                    }).remove();
+                }
+                $.each(data.results, function (i, item) {
+                    if (!option(id, item.id).length) {
+                        $select.append($('<option>').val(item.id).text(item.value));
+                    }
+                });
+                state.next = data.next;
+                $field.data('popup-state', state);
+                $field.find('[data-popup-action="more"]').toggle(data.more);
+            }
+
+            if (searchMemo.hasOwnProperty(key)) {
+                show(searchMemo[key]);
+                return;
+            }
+            xhr = state.xhr = $.getJSON(url, params, function (data) {
+                remember(key, data);
+                show(data);
+            });
+            xhr.always(function () {
+                if (state.xhr === xhr) {
+                    state.xhr = null;
+                }
+            });
+            $field.data('popup-state', state);
+        };
+
+        /********应用其他弹窗、其他页面的修改 不改变选中项**********/
+        popupField.apply = function (id, change) {
+            popupField.forget(id);
+            popupField.fill(id);
+            switch (change.op) {
+                case 'create':
+                    if (!option(id, change.id).length) {
+                        select(id).append($('<option>').val(change.id).text(change.value));
+                    }
+                    break;
+                case 'update':
+                    option(id, change.id).text(change.value);
+                    break;
+                case 'delete':
+                    option(id, change.id).remove();
+                    break;
+            }
+            popupField.refresh(id);
+        };
+
+        /********按changes url轮询修改记录 页面隐藏时暂停**********/
+        var changeLogs = {};
+
+        popupField.sync = function (url) {
+            var log = changeLogs[url];
+            var next = function () {
+                log.timer = setTimeout(function () {
+                    popupField.sync(url);
+                }, log.poll);
+            };
+            if (document.hidden) {
+                next();
+                return;
+            }
+            $.getJSON(url, {since: log.token}, function (data) {
+                var $fields = $('[data-popup-field]').filter(function () {
+                    return $(this).data('changes-url') === url;
+                });
+                $fields.each(function () {
+                    var $field = $(this), id = $field.data('popup-field');
+                    if (data.reset) {
+                        popupField.forget(id);
+                        if ($field.data('choices-url')) {
+                            popupField.load(id, true);
+                        }
+                    } else {
+                        $.each(data.changes, function (i, change) {
+                            popupField.apply(id, change);
+                        });
+                    }
+                });
+                log.token = data.token;
+            }).always(next);
+        };
+
+        popupField.watch = function ($field) {
+            var url = $field.data('changes-url'), token = $field.data('changes-token');
+            if (!url) {
+                return;
+            }
+            if (changeLogs[url]) {
+                // 最早渲染的控件决定起点
+                changeLogs[url].token = Math.min(changeLogs[url].token, token);
+                return;
+            }
+            changeLogs[url] = {token: token, poll: $field.data('changes-poll') || 5000};
+            changeLogs[url].timer = setTimeout(function () {
+                popupField.sync(url);
+            }, changeLogs[url].poll);
+        };
+
+        /********流式加载全部选项 每读到一段就添加 不等整个列表**********/
+        popupField.stream = function (id) {
+            var $field = container(id), element = document.getElementById(id), present = {}, buffer = '';
+            if (!element || !window.fetch) {
+                return;
+            }
+            $.each(element.options, function (i, node) {
+                present[node.value] = true;
+            });
+
+            function append(text, done) {
+                var lines = (buffer + text).split('\n'), fragment = document.createDocumentFragment();
+                buffer = done ? '' : lines.pop();
+                $.each(lines, function (i, line) {
+                    if (!line) {
+                        return;
+                    }
+                    var item = JSON.parse(line);
+                    if (!present[item.id]) {
+                        var node = document.createElement('option');
+                        node.value = item.id;
+                        node.textContent = item.value;
+                        fragment.appendChild(node);
+                    }
+                });
+                element.appendChild(fragment);
+            }
+
+            fetch($field.data('export-url'), {credentials: 'same-origin'}).then(function (response) {
+                if (!response.body || !response.body.getReader || !window.TextDecoder) {
+                    return response.text().then(function (text) {
+                        append(text, true);
+                    });
+                }
+                var reader = response.body.getReader(), decoder = new TextDecoder();
+
+                function pump() {
+                    return reader.read().then(function (result) {
+                        append(result.done ? decoder.decode() : decoder.decode(result.value, {stream: true}),
+                            result.done);
+                        if (!result.done) {
+                            return pump();
+                        }
+                    });
+                }
+
+                return pump();
+            }).then(function () {
+                popupField.refresh(id);
+            });
+        };
+
+        popupField.init = function (root) {
+            $(root || document).find('[data-popup-field]').each(function () {
+                var $field = $(this), id = $field.data('popup-field');
+                popupField.refresh(id);
+                popupField.watch($field);
+                if ($field.data('export-url') && !$field.data('popup-streamed')) {
+                    $field.data('popup-streamed', true);
+                    popupField.stream(id);
+                }
+                if ($field.data('choices-url') && !$field.data('popup-state')) {
+                    $field.data('popup-state', {q: '', next: null});
+                    popupField.load(id, true);
+                }
+            });
+        };
+
+        $(document).on('click', '[data-popup-field] [data-popup-action]', function (event) {
+            var $button = $(this), id = $button.closest('[data-popup-field]').data('popup-field');
+            var action = $button.data('popup-action');
+            event.preventDefault();
+            if ($button.hasClass('layui-btn-disabled')) {
+                return;
+            }
+            if (action === 'more') {
+                popupField.load(id, false);
+            } else if (popupField[action]) {
+                popupField[action](id);
+            }
+        });
+
+        /********指针停留片刻或键盘聚焦时预加载 移开则取消**********/
+        var preloadButtons = '[data-preload] [data-popup-action="add"], [data-preload] [data-popup-action="change"]';
+
+        $(document).on('mouseenter focusin', preloadButtons, function (event) {
+            var $button = $(this), id = $button.closest('[data-popup-field]').data('popup-field');
+            var action = $button.data('popup-action');
+            clearTimeout($button.data('popup-preload'));
+            if ($button.hasClass('layui-btn-disabled')) {
+                return;
+            }
+            $button.data('popup-preload', setTimeout(function () {
+                popupField.preload(id, action);
+            }, event.type === 'focusin' ? 0 : 80));
+        });
+
+        $(document).on('mouseleave', preloadButtons, function () {
+            clearTimeout($(this).data('popup-preload'));
+        });
+
+        $(document).on('keydown', preloadButtons, function (event) {
+            if (event.key === 'Enter' || event.key === ' ') {
+                event.preventDefault();
+                $(this).trigger('click');
+            }
+        });
+
+        /********页面层的表单用ajax提交 成功返回json 失败返回带错误的表单**********/
+        $(document).on('submit', '[data-popup-fragment] form', function (event) {
+            var form = this, $fragment = $(form).closest('[data-popup-fragment]');
+            event.preventDefault();
+            fetch(form.action, {
+                method: 'POST',
+                credentials: 'same-origin',
+                body: new FormData(form),
+                headers: {'X-Requested-With': 'XMLHttpRequest', 'X-CSRFToken': getCookie('csrftoken')}
+            }).then(function (response) {
+                var json = (response.headers.get('Content-Type') || '').indexOf('application/json') === 0;
+                return response.text().then(function (text) {
+                    return {json: json, ok: response.ok, text: text};
+                });
+            }).then(function (result) {
+                if (result.json) {
+                    layer.close($fragment.data('layer-index'));
+                    popupField.complete(JSON.parse(result.text));
+                } else if (result.ok) {
+                    $fragment.html(result.text);
+                } else {
+                    layer.alert('保存失败 ' + result.text);
+                }
+            }, function (error) {
+                layer.alert('保存失败 ' + error);
+            });
+        });
+
+        /********输入停顿后再查询 页面中已有的结果立即显示**********/
+        $(document).on('input', '[data-popup-field] [data-popup-search]', function () {
+            var $field = $(this).closest('[data-popup-field]'), id = $field.data('popup-field');
+            var state = $field.data('popup-state') || {q: '', next: null}, q = $.trim($(this).val());
+            if (q === state.q) {
+                return;
+            }
+            clearTimeout(state.timer);
+            state.q = q;
+            $field.data('popup-state', state);
+            state.timer = setTimeout(function () {
+                popupField.load(id, true);
+            }, searchMemo.hasOwnProperty(memoKey($field.data('choices-url'), choiceParams($field, q))) ? 0 : SEARCH_DELAY);
+        });
+
+        $(document).on('focus mousedown touchstart', '[data-shared-choices] select', function () {
+            popupField.fill(this.id);
+        });
+
+        $(document).on('change', 'select', function () {
+            if (this.id && container(this.id).length) {
+                popupField.refresh(this.id);
+            }
+        });
+
+        window.popupField = popupField;
+        popupField.init();
+    }
+
+    function boot() {
+        ensure(start);
+    }
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', boot);
+    } else {
+        boot();
+    }
+})(window, document);
@@ -1,11 +1,29 @@
+import calendar
+import functools
+import hashlib
+import json
+
 import django
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils.decorators import classonlymethod
-from django.views.generic import CreateView, UpdateView, DeleteView
+from django.utils.module_loading import import_string
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Q
+from django.forms import ModelForm
+from django.views.generic import View, CreateView, UpdateView, DeleteView
+from django.contrib.auth import get_permission_codename
 from django.contrib.auth.mixins import PermissionRequiredMixin
-from django.http.response import JsonResponse
+from django.http import Http404, QueryDict
+from django.middleware.csrf import get_token
+from django.http.response import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.template.loader import get_template
 from django.template.response import TemplateResponse
-from django.core.exceptions import ImproperlyConfigured
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.translation import get_language
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist, ImproperlyConfigured, ValidationError
+from . import __version__, cache, metrics
 from .fields import ForeignKeyWidget, ManyToManyWidget
 
 if django.VERSION >= (2, 0):
@@ -13,8 +31,376 @@ if django.VERSION >= (2, 0):
 else:
     from django.conf.urls import url, include
 
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # django<3.0
+    sync_to_async = None
+
+
+COMPLETION_MODES = ('template', 'message')
+
+# the whole response of message completion mode, no template and no external asset
+COMPLETION_MESSAGE = ('<!DOCTYPE html><script>(function (data) {'
+                      'var target = window.opener || window.parent;'
+                      'if (target && target !== window) {target.postMessage({popupField: data}, window.location.origin);}'
+                      '})(%s);</script>')
+
+
+def json_for_script(data):
+    """
+    Dump data as json which is safe to embed inside <script>
+    """
+    return json.dumps(data, cls=DjangoJSONEncoder).replace(
+        '<', '\\u003c').replace('>', '\\u003e').replace('&', '\\u0026')
+
+
+def is_prefetch(request):
+    """
+    Whether the request is a speculative prefetch: Sec-Purpose sent by browsers for <link rel="prefetch">,
+    Purpose sent by the preload of the runtime
+    """
+    purpose = request.META.get('HTTP_SEC_PURPOSE') or request.META.get('HTTP_PURPOSE') or ''
+    return purpose.split(';')[0].strip() == 'prefetch'
+
+
+def cached_view(method):
+    """
+    Build the view class of an action once per viewset class
+    """
+
+    @functools.wraps(method)
+    def wrapper(cls):
+        view_classes = cls.__dict__.get('_view_classes')
+        if view_classes is None:
+            view_classes = {}
+            cls._view_classes = view_classes
+        if method.__name__ not in view_classes:
+            view_classes[method.__name__] = method(cls)
+        return view_classes[method.__name__]
+
+    return wrapper
+
+
+class PopupMetricsMixin(object):
+    """
+    Measure the latency and the queries of dispatch, tagged with the class name of the viewset.
+    The latency of a template response ends when it is rendered, its queries are counted until dispatch returns.
+    """
+    popup_action = None
+    viewset_name = ''
+
+    def dispatch(self, request, *args, **kwargs):
+        if not metrics.enabled():
+            return super(PopupMetricsMixin, self).dispatch(request, *args, **kwargs)
+
+        timer = metrics.Timer('view.{}'.format(self.popup_action), self.viewset_name, method=request.method)
+        if is_prefetch(request):
+            timer.tags['prefetch'] = True
+        with timer.count_queries():
+            try:
+                response = super(PopupMetricsMixin, self).dispatch(request, *args, **kwargs)
+            except Exception as e:
+                timer.stop(error=type(e).__name__)
+                raise
+        if getattr(response, 'is_rendered', True):
+            timer.stop(status=response.status_code)
+        else:
+            response.add_post_render_callback(lambda response: timer.stop(status=response.status_code))
+        return response
+
+
+class PopupLabelMixin(object):
+    """
+    Build labels of objects with the query shaping of the viewset
+    """
+    viewset = None
+
+    def shape_queryset(self, queryset, only=()):
+        if self.viewset is None:
+            return queryset
+        return self.viewset.get_label_queryset(queryset, only=only)
+
+    def get_to_field_name(self):
+        """
+        Return the column of `to_field_name`, the unique field of the model whose values the results carry
+        instead of the pk as the to_field of a ForeignKey, None without it. Raise ValueError for another field.
+        """
+        name = self.request.GET.get('to_field_name')
+        if not name:
+            return None
+        try:
+            field = self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise ValueError('{} is not a field of {}'.format(name, self.model.__name__))
+        if not getattr(field, 'concrete', False) or not field.unique:
+            raise ValueError('{} is not a unique field of {}'.format(name, self.model.__name__))
+        return field.attname
+
+    def get_label(self, obj):
+        if self.viewset is None:
+            return obj.__str__()
+        return self.viewset.get_label(obj)
+
+    def get_read_db(self):
+        if self.viewset is None:
+            return None
+        return self.viewset.get_read_db(self.request)
+
+    def get_write_db(self):
+        if self.viewset is not None and self.viewset.write_db is not None:
+            return self.viewset.write_db
+        return router.db_for_write(self.model)
+
+    def route(self, queryset, write=False):
+        """
+        Send queryset to the write database or to the read database of the viewset
+        """
+        db = self.get_write_db() if write else self.get_read_db()
+        return queryset.using(db) if db is not None else queryset
+
+    def get_saved_labels(self, objects):
+        """
+        Return labels of just saved objects, fetched again in one query when the labels need related objects
+        """
+        if self.viewset is not None and (self.viewset.label_select_related or self.viewset.label_prefetch_related):
+            fetched = self.shape_queryset(self.route(self.model._default_manager.filter(
+                pk__in=[obj.pk for obj in objects]), write=True))
+            fetched = {obj.pk: obj for obj in fetched}
+            objects = [fetched.get(obj.pk, obj) for obj in objects]
+        return [self.get_label(obj) for obj in objects]
+
+
+class PopupChangeMixin(PopupLabelMixin):
+    """
+    changed() is called after every write of the popup views with the results sent to the client,
+    [{'id': ..., 'value': ...}], bulk_create sends no post_save
+    """
+    written = False
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super(PopupChangeMixin, self).dispatch(request, *args, **kwargs)
+        return self.mark_written(response)
+
+    def mark_written(self, response):
+        """
+        After a write, read from the write database for read_your_writes seconds
+        """
+        if self.written and self.viewset is not None and self.viewset.read_db is not None:
+            response.set_cookie(self.viewset.get_written_cookie_name(), '1', max_age=self.viewset.read_your_writes,
+                                httponly=True, samesite='Lax')
+        return response
+
+    def save_form(self, form):
+        if type(form).save is not ModelForm.save:
+            # a custom save() may do anything, give it the write database through the instance
+            form.instance._state.db = self.get_write_db()
+            return form.save()
+        obj = form.save(commit=False)
+        obj.save(using=self.get_write_db())
+        form.save_m2m()
+        return obj
+
+    def changed(self, op, results):
+        using = self.get_write_db()
+        self.written = True
+        if cache.is_watched(self.model):
+            transaction.on_commit(functools.partial(cache.bump_version, self.model), using=using)
+        if self.viewset is None:
+            return
+        op = {'bulk_create': 'create', 'bulk_delete': 'delete'}.get(op, op)
+        if self.viewset.change_log:
+            changes = [{'op': op, 'id': result['id'], 'value': result['value']} for result in results]
+            transaction.on_commit(functools.partial(cache.log_changes, self.viewset.get_class_name(), changes,
+                                                    self.viewset.change_log_timeout), using=using)
+
+
+class PopupCompletionMixin(PopupChangeMixin):
+    """
+    Build the response after a successful create or update:
+    json for ajax request, a tiny postMessage page in message mode, popup/success.html otherwise
+    """
+    completion_mode = 'template'
+
+    def get_completion_data(self, op):
+        data = {'op': op, 'id': self.object.id, 'value': self.get_saved_labels([self.object])[0]}
+        if 'to_field' in self.request.GET:
+            data['to_field'] = self.request.GET['to_field']
+        return data
+
+    def wants_json(self):
+        return (self.request.META.get('HTTP_X_REQUESTED_WITH') == 'XMLHttpRequest' or
+                'application/json' in self.request.META.get('HTTP_ACCEPT', ''))
+
+    def render_completion(self, op):
+        data = self.get_completion_data(op)
+        self.changed(op, [data])
+        if self.wants_json():
+            return JsonResponse(data=data)
+        if self.completion_mode == 'message':
+            return HttpResponse(COMPLETION_MESSAGE % json_for_script(data))
+        return TemplateResponse(self.request, 'popup/success.html', context=data)
+
+
+class PopupFastDeleteMixin(PopupChangeMixin):
+    # delete with one DELETE query when the collector has nothing to visit: no relation to the model and no
+    # delete signal, the collector deletes the queryset at once otherwise
+    fast_delete = False
+    # fields fetched for the response with the label_only of the viewset, every field when both are empty
+    # because __str__ may read any of them
+    fast_delete_fields = ()
+
+    def get_fast_delete_fields(self):
+        fields = list(self.fast_delete_fields)
+        if self.viewset is not None:
+            fields.extend(self.viewset.label_only)
+        return fields
+
+    def defer_for_delete(self, queryset):
+        fields = self.get_fast_delete_fields()
+        if self.fast_delete and fields:
+            queryset = queryset.only('pk', *fields)
+        return queryset
+
+    def delete_objects(self, objects):
+        """
+        Delete the fetched objects with one queryset delete, a single DELETE query when the collector can fast
+        delete them, return the number of deleted objects
+        """
+        queryset = self.model._default_manager.using(self.get_write_db()).filter(pk__in=[obj.pk for obj in objects])
+        return queryset.delete()[0]
+
+
+class PopupConditionalMixin(object):
+    """
+    Answer GET with ETag and Last-Modified validators and 304 Not Modified when they match.
+    The page holds a csrf token, validators are private to the csrf secret and the user.
+    """
+    conditional_get = False
+    # field of the object bumped by every change, e.g. an integer version
+    version_field = None
+    # datetime field of the object updated by every change
+    last_modified_field = None
+    # keep the rendered page in the cache, only worth it for the create page
+    cache_page = False
+    cache_alias = None
+    cache_timeout = 300
+
+    def get_template_digest(self):
+        template_names = self.get_template_names()
+        key = tuple(template_names)
+        digests = self.__class__.__dict__.get('_template_digests')
+        if digests is None:
+            digests = {}
+            self.__class__._template_digests = digests
+        if key not in digests:
+            template = get_template(template_names[0]) if len(template_names) == 1 else None
+            source = getattr(getattr(template, 'template', None), 'source', '')
+            digests[key] = hashlib.sha256(source.encode('utf-8')).hexdigest()
+        return digests[key]
+
+    def get_etag_parts(self):
+        """
+        Return what the page depends on, None when it can't be validated
+        """
+        # the page needs a csrf cookie, set it now if missing to know the secret
+        get_token(self.request)
+        secret = self.request.META.get('CSRF_COOKIE')
+        if secret is None:
+            return None
+        form_class = self.get_form_class()
+        parts = [__version__, self.viewset_name, self.popup_action, self.get_template_digest(), secret,
+                 self.request.user.pk, get_language(), self.request.GET.urlencode(),
+                 form_class.__module__, form_class.__name__, ','.join(form_class.base_fields)]
+        # versions of the models listed by the choice fields
+        for field in form_class.base_fields.values():
+            queryset = getattr(field, 'queryset', None)
+            if queryset is not None:
+                parts.append(cache.get_version(queryset.model))
+        return parts
 
-class PopupCreateView(PermissionRequiredMixin, CreateView):
+    def get_last_modified(self):
+        obj = getattr(self, 'object', None)
+        if obj is None or self.last_modified_field is None:
+            return None
+        value = getattr(obj, self.last_modified_field)
+        return calendar.timegm(value.utctimetuple()) if value is not None else None
+
+    def get_validators(self):
+        parts = self.get_etag_parts()
+        if parts is None:
+            return None, None
+        digest = hashlib.sha256('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:32]
+        return 'W/"{}"'.format(digest), self.get_last_modified()
+
+    def conditional(self, render):
+        """
+        Return 304 when the validators match, the cached page or render()
+        """
+        if not self.conditional_get:
+            return render()
+        etag, last_modified = self.get_validators()
+        if etag is None:
+            return render()
+
+        response = get_conditional_response(self.request, etag=etag, last_modified=last_modified)
+        if response is None:
+            backend = cache.get_cache(self.cache_alias) if self.cache_page else None
+            key = 'popup_field:page:{}'.format(etag)
+            content = backend.get(key) if backend is not None else None
+            if content is not None:
+                response = HttpResponse(content)
+            else:
+                response = render()
+                if backend is not None and response.status_code == 200:
+                    if getattr(response, 'is_rendered', True):
+                        backend.set(key, response.content, self.cache_timeout)
+                    else:
+                        response.add_post_render_callback(
+                            lambda response: backend.set(key, response.content, self.cache_timeout))
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie',))
+        return response
+
+
+class PopupPreloadMixin(object):
+    """
+    Let the browser reuse the page prefetched by the preload of the runtime when the popup is opened
+    """
+    # seconds a prefetched page can be reused
+    preload_max_age = 10
+
+    def preloaded(self, response):
+        if is_prefetch(self.request) and response.status_code == 200:
+            response['Cache-Control'] = 'private, max-age={}'.format(self.preload_max_age)
+        return response
+
+
+class PopupFragmentMixin(object):
+    """
+    Render only the form with template_name_fragment when the runtime asks for ?fragment
+    """
+    template_name_fragment = 'popup/fragment.html'
+
+    def is_fragment(self):
+        return 'fragment' in self.request.GET
+
+    def get_template_names(self):
+        if self.is_fragment():
+            return [self.template_name_fragment]
+        return super(PopupFragmentMixin, self).get_template_names()
+
+    def get_context_data(self, **kwargs):
+        if self.is_fragment():
+            kwargs['action'] = self.request.get_full_path()
+        return super(PopupFragmentMixin, self).get_context_data(**kwargs)
+
+
+class PopupCreateView(PopupMetricsMixin, PopupConditionalMixin, PopupPreloadMixin, PopupFragmentMixin,
+                      PopupCompletionMixin, PermissionRequiredMixin, CreateView):
+    popup_action = 'create'
     popup_name = None
 
     def get_context_data(self, **kwargs):
@@ -23,15 +409,18 @@ class PopupCreateView(PermissionRequiredMixin, CreateView):
         kwargs['popup_name'] = self.popup_name
         return super(PopupCreateView, self).get_context_data(**kwargs)
 
+    def get(self, request, *args, **kwargs):
+        self.object = None
+        return self.preloaded(self.conditional(lambda: self.render_to_response(self.get_context_data())))
+
     def form_valid(self, form):
-        self.object = form.save()
-        context = {'op': 'create', 'id': self.object.id, 'value': self.object.__str__()}
-        if 'to_field' in self.request.GET:
-            context['to_field'] = self.request.GET['to_field']
-        return TemplateResponse(self.request, 'popup/success.html', context=context)
+        self.object = self.save_form(form)
+        return self.render_completion('create')
 
 
-class PopupUpdateView(PermissionRequiredMixin, UpdateView):
+class PopupUpdateView(PopupMetricsMixin, PopupConditionalMixin, PopupPreloadMixin, PopupFragmentMixin,
+                      PopupCompletionMixin, PermissionRequiredMixin, UpdateView):
+    popup_action = 'update'
     slug_field = 'id'
     context_object_name = 'popup'
     popup_name = None
@@ -42,27 +431,509 @@ class PopupUpdateView(PermissionRequiredMixin, UpdateView):
         kwargs['popup_name'] = self.popup_name
         return super(PopupUpdateView, self).get_context_data(**kwargs)
 
+    def get_queryset(self):
+        # the object is edited from the read database, saved from the write database
+        write = self.request.method not in ('GET', 'HEAD')
+        return self.route(super(PopupUpdateView, self).get_queryset(), write=write)
+
+    def get_etag_parts(self):
+        parts = super(PopupUpdateView, self).get_etag_parts()
+        if parts is None or (self.version_field is None and self.last_modified_field is None):
+            return None
+        parts.append(self.object.pk)
+        if self.version_field is not None:
+            parts.append(getattr(self.object, self.version_field))
+        if self.last_modified_field is not None:
+            parts.append(getattr(self.object, self.last_modified_field))
+        return parts
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        return self.preloaded(self.conditional(lambda: self.render_to_response(self.get_context_data())))
+
     def form_valid(self, form):
-        self.object = form.save()
-        context = {'op': 'update', 'id': self.object.id, 'value': self.object.__str__()}
-        if 'to_field' in self.request.GET:
-            context['to_field'] = self.request.GET['to_field']
-        return TemplateResponse(self.request, 'popup/success.html', context=context)
+        self.object = self.save_form(form)
+        return self.render_completion('update')
 
 
-class PopupDeleteView(PermissionRequiredMixin, DeleteView):
+class PopupDeleteView(PopupMetricsMixin, PopupFastDeleteMixin, PermissionRequiredMixin, DeleteView):
+    popup_action = 'delete'
     slug_field = 'id'
 
+    def get_queryset(self):
+        return self.defer_for_delete(self.shape_queryset(
+            self.route(super(PopupDeleteView, self).get_queryset(), write=True)))
+
+    def post(self, request, *args, **kwargs):
+        # DeleteView of django>=4.0 handles post with a form instead of delete()
+        return self.delete(request, *args, **kwargs)
+
     def delete(self, request, *args, **kwargs):
         if not self.model:
             raise ImproperlyConfigured('model must be override in PopupDeleteView')
 
         self.object = self.get_object()
-        data = {'op': 'delete', 'id': self.object.id, 'value': self.object.__str__()}
-        self.object.delete()
+        data = {'op': 'delete', 'id': self.object.id, 'value': self.get_label(self.object)}
+        if self.fast_delete:
+            self.delete_objects([self.object])
+        else:
+            self.object.delete(using=self.get_write_db())
+        self.changed('delete', [data])
+        return JsonResponse(data=data)
+
+
+class PopupAsyncMixin(object):
+    """
+    Async dispatch of AsyncPopupCreateView、AsyncPopupUpdateView and AsyncPopupDeleteView.
+    has_permission() runs in a thread, the handlers are coroutines using the async ORM.
+    Queries run in other threads, metrics report their latency only.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        if not await sync_to_async(self.has_permission)():
+            return await sync_to_async(self.handle_no_permission)()
+        if request.method.lower() in self.http_method_names:
+            handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+        else:
+            handler = self.http_method_not_allowed
+        if not metrics.enabled():
+            return self.mark_written(await handler(request, *args, **kwargs))
+
+        timer = metrics.Timer('view.{}'.format(self.popup_action), self.viewset_name, method=request.method)
+        timer.queries = None
+        if is_prefetch(request):
+            timer.tags['prefetch'] = True
+        try:
+            response = self.mark_written(await handler(request, *args, **kwargs))
+        except Exception as e:
+            timer.stop(error=type(e).__name__)
+            raise
+        if getattr(response, 'is_rendered', True):
+            timer.stop(status=response.status_code)
+        else:
+            response.add_post_render_callback(lambda response: timer.stop(status=response.status_code))
+        return response
+
+    async def aget_object(self):
+        queryset = self.get_queryset()
+        try:
+            return await queryset.aget(pk=self.kwargs[self.pk_url_kwarg])
+        except queryset.model.DoesNotExist:
+            raise Http404('No {} found matching the query'.format(queryset.model._meta.verbose_name))
+
+    async def asave_form(self, form):
+        if type(form).save is not ModelForm.save:
+            # a custom save() may do anything, keep it
+            return await sync_to_async(self.save_form)(form)
+        obj = form.save(commit=False)
+        await obj.asave(using=self.get_write_db())
+        await sync_to_async(form.save_m2m)()
+        return obj
+
+    async def apost_form(self, op):
+        form = self.get_form()
+        if not await sync_to_async(form.is_valid)():
+            return self.form_invalid(form)
+        self.object = await self.asave_form(form)
+        return await sync_to_async(self.render_completion)(op)
+
+
+class AsyncPopupCreateView(PopupAsyncMixin, PopupCreateView):
+    http_method_names = ['get', 'head', 'post', 'options']
+
+    async def get(self, request, *args, **kwargs):
+        self.object = None
+        return self.preloaded(await sync_to_async(self.conditional)(
+            lambda: self.render_to_response(self.get_context_data())))
+
+    async def head(self, request, *args, **kwargs):
+        return await self.get(request, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        self.object = None
+        return await self.apost_form('create')
+
+
+class AsyncPopupUpdateView(PopupAsyncMixin, PopupUpdateView):
+    http_method_names = ['get', 'head', 'post', 'options']
+
+    async def get(self, request, *args, **kwargs):
+        self.object = await self.aget_object()
+        return self.preloaded(await sync_to_async(self.conditional)(
+            lambda: self.render_to_response(self.get_context_data())))
+
+    async def head(self, request, *args, **kwargs):
+        return await self.get(request, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        self.object = await self.aget_object()
+        return await self.apost_form('update')
+
+
+class AsyncPopupDeleteView(PopupAsyncMixin, PopupDeleteView):
+    http_method_names = ['post', 'delete', 'options']
+
+    async def post(self, request, *args, **kwargs):
+        return await self.delete(request, *args, **kwargs)
+
+    async def delete(self, request, *args, **kwargs):
+        if not self.model:
+            raise ImproperlyConfigured('model must be override in PopupDeleteView')
+
+        self.object = await self.aget_object()
+        data = {'op': 'delete', 'id': self.object.id, 'value': await sync_to_async(self.get_label)(self.object)}
+        if self.fast_delete:
+            await sync_to_async(self.delete_objects)([self.object])
+        else:
+            await self.object.adelete(using=self.get_write_db())
+        await sync_to_async(self.changed)('delete', [data])
+        return JsonResponse(data=data)
+
+
+class PopupBulkDeleteView(PopupMetricsMixin, PopupFastDeleteMixin, PermissionRequiredMixin, View):
+    """
+    Delete many objects in one request and one transaction.
+    Accept json {"pks": [...]} or repeated `pk`.
+    """
+    popup_action = 'bulk_delete'
+    model = None
+    bulk_max_rows = 100
+    http_method_names = ['post']
+
+    def get_pks(self):
+        if self.request.content_type == 'application/json':
+            pks = json.loads(self.request.body.decode('utf-8')).get('pks', [])
+            if not isinstance(pks, list) or not all(
+                    isinstance(pk, (str, int)) and not isinstance(pk, bool) for pk in pks):
+                raise ValueError('pks must be a list of strings or integers')
+            return pks
+        return self.request.POST.getlist('pk')
+
+    def get_queryset(self, pks):
+        return self.defer_for_delete(self.shape_queryset(
+            self.model._default_manager.using(self.get_write_db()).filter(pk__in=pks)))
+
+    def post(self, request, *args, **kwargs):
+        if not self.model:
+            raise ImproperlyConfigured('model must be override in PopupBulkDeleteView')
+
+        try:
+            pks = self.get_pks()
+        except (ValueError, AttributeError):
+            return JsonResponse(data={'error': 'invalid pks'}, status=400)
+        if not pks:
+            return JsonResponse(data={'error': 'no pks'}, status=400)
+        if len(pks) > self.bulk_max_rows:
+            return JsonResponse(data={'error': 'at most {} rows'.format(self.bulk_max_rows)}, status=400)
+
+        try:
+            with transaction.atomic(using=self.get_write_db()):
+                objects = list(self.get_queryset(pks))
+                results = [{'id': obj.id, 'value': self.get_label(obj)} for obj in objects]
+                if self.fast_delete:
+                    self.delete_objects(objects)
+                else:
+                    for obj in objects:
+                        obj.delete(using=self.get_write_db())
+        except (ValueError, TypeError, ValidationError):
+            return JsonResponse(data={'error': 'invalid pks'}, status=400)
+        self.changed('bulk_delete', results)
+
+        data = {'op': 'bulk_delete', 'results': results}
+        if 'to_field' in request.GET:
+            data['to_field'] = request.GET['to_field']
         return JsonResponse(data=data)
 
 
+class PopupBulkCreateView(PopupMetricsMixin, PopupChangeMixin, PermissionRequiredMixin, View):
+    """
+    Create many objects in one request and one transaction.
+    Accept json {"rows": [{field: value}, ...]} or `names` with one value of `bulk_field` per line.
+    """
+    popup_action = 'bulk_create'
+    model = None
+    form_class = None
+    # form field filled by each line of `names`, default is the first field of form_class
+    bulk_field = None
+    bulk_max_rows = 100
+    http_method_names = ['post']
+
+    def get_bulk_field(self):
+        if self.bulk_field is None:
+            return next(iter(self.form_class.base_fields))
+        return self.bulk_field
+
+    def get_rows(self):
+        if self.request.content_type == 'application/json':
+            rows = json.loads(self.request.body.decode('utf-8')).get('rows', [])
+            if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+                raise ValueError('rows must be a list of objects')
+            return rows
+        field = self.get_bulk_field()
+        names = []
+        for name in self.request.POST.get('names', '').splitlines():
+            name = name.strip()
+            if name and name not in names:
+                names.append(name)
+        return [{field: name} for name in names]
+
+    def get_form_data(self, row):
+        """
+        Return the data of the form of row as posted by a form, a list for a field with many values.
+        Raise ValueError with the invalid fields for a value which isn't a string, a number or a list of them
+        """
+        data = QueryDict(mutable=True)
+        invalid = []
+        for name, value in row.items():
+            values = value if isinstance(value, list) else [value]
+            if all(isinstance(item, (str, int, float)) for item in values):
+                data.setlist(name, [str(item) for item in values])
+            elif value is not None:
+                invalid.append(name)
+        if invalid:
+            raise ValueError(invalid)
+        return data
+
+    def can_bulk_insert(self):
+        if self.model._meta.parents:
+            return False
+        features = connections[self.get_write_db()].features
+        return getattr(features, 'can_return_rows_from_bulk_insert',
+                       getattr(features, 'can_return_ids_from_bulk_insert', False))
+
+    def save(self, forms):
+        objects = [form.save(commit=False) for form in forms]
+        if self.can_bulk_insert():
+            objects = self.model._default_manager.using(self.get_write_db()).bulk_create(objects)
+            if self.viewset is not None:
+                # bulk_create sends no post_save, index the rows in the transaction of the insert
+                self.viewset.get_search_backend().changed('create', [obj.pk for obj in objects],
+                                                          self.get_write_db())
+        else:
+            for obj in objects:
+                obj.save(using=self.get_write_db())
+        for form in forms:
+            form.save_m2m()
+        return objects
+
+    def post(self, request, *args, **kwargs):
+        if not self.model or not self.form_class:
+            raise ImproperlyConfigured('model and form_class must be override in PopupBulkCreateView')
+
+        try:
+            rows = self.get_rows()
+        except (ValueError, AttributeError):
+            return JsonResponse(data={'error': 'invalid rows'}, status=400)
+        if not rows:
+            return JsonResponse(data={'error': 'no rows'}, status=400)
+        if len(rows) > self.bulk_max_rows:
+            return JsonResponse(data={'error': 'at most {} rows'.format(self.bulk_max_rows)}, status=400)
+
+        forms = []
+        errors = {}
+        for index, row in enumerate(rows):
+            try:
+                form = self.form_class(data=self.get_form_data(row))
+            except ValueError as e:
+                errors[index] = {name: ['invalid value'] for name in e.args[0]}
+                continue
+            if not form.is_valid():
+                errors[index] = form.errors
+            forms.append(form)
+        if errors:
+            return JsonResponse(data={'errors': errors}, status=400)
+        try:
+            with transaction.atomic(using=self.get_write_db()):
+                objects = self.save(forms)
+        except IntegrityError:
+            # the message of the database may tell its schema
+            return JsonResponse(data={'error': 'rows conflict with existing objects'}, status=400)
+
+        labels = self.get_saved_labels(objects)
+        data = {'op': 'bulk_create', 'results': [{'id': obj.id, 'value': label} for obj, label in zip(objects, labels)]}
+        self.changed('bulk_create', data['results'])
+        if 'to_field' in request.GET:
+            data['to_field'] = request.GET['to_field']
+        return JsonResponse(data=data)
+
+
+class PopupChoicesView(PopupMetricsMixin, PopupLabelMixin, PermissionRequiredMixin, View):
+    """
+    Return choices as json, filtered by `q` and paginated by pk with `after` and `limit`.
+    """
+    popup_action = 'choices'
+    model = None
+    search_fields = ()
+    paginate_by = 20
+    max_paginate_by = 100
+    # keep the results in the cache of cache_alias for search_cache_timeout, invalidated by the version of model
+    search_cache = False
+    search_cache_timeout = 60
+    cache_alias = None
+
+    to_field_name = None
+
+    def get_queryset(self):
+        if not self.model:
+            raise ImproperlyConfigured('model must be override in PopupChoicesView')
+        return self.shape_queryset(self.route(self.model._default_manager.all()), only=(self.to_field_name,))
+
+    def search(self, queryset, q):
+        if self.viewset is not None:
+            return self.viewset.get_search_backend().search(queryset, q)
+        condition = Q()
+        for field in self.search_fields:
+            condition |= Q(**{'{}__icontains'.format(field): q})
+        return queryset.filter(condition)
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.GET.get('limit', self.paginate_by))
+        except ValueError:
+            limit = self.paginate_by
+        return max(1, min(limit, self.max_paginate_by))
+
+    def get_results_cache_key(self, queryset):
+        """
+        Return the cache key of the results of queryset, None if they can't be cached
+        """
+        try:
+            sql = str(queryset.query)
+        except EmptyResultSet:
+            return None
+        digest = hashlib.sha256('{}|{}'.format(sql, self.to_field_name).encode('utf-8')).hexdigest()[:32]
+        return 'popup_field:search:{}:{}:{}'.format(self.viewset_name, cache.get_version(self.model), digest)
+
+    def get_results(self, queryset, limit):
+        objects = list(queryset)
+        more = len(objects) > limit
+        objects = objects[:limit]
+        return {
+            'results': [{'id': getattr(obj, self.to_field_name or 'pk'), 'value': self.get_label(obj)}
+                        for obj in objects],
+            'more': more,
+            'next': objects[-1].pk if more else None,
+        }
+
+    def get(self, request, *args, **kwargs):
+        try:
+            self.to_field_name = self.get_to_field_name()
+        except ValueError as e:
+            return JsonResponse(data={'error': str(e)}, status=400)
+        queryset = self.get_queryset()
+        q = request.GET.get('q', '').strip()
+        if q and self.search_fields:
+            queryset = self.search(queryset, q)
+        after = request.GET.get('after')
+        limit = self.get_limit()
+        try:
+            if after:
+                queryset = queryset.filter(pk__gt=after)
+            queryset = queryset.order_by('pk')[:limit + 1]
+            # the query, the page and the filters of the view are all in the sql
+            key = self.get_results_cache_key(queryset) if self.search_cache else None
+            backend = cache.get_cache(self.cache_alias) if key is not None else None
+            data = backend.get(key) if backend is not None else None
+            if data is None:
+                data = self.get_results(queryset, limit)
+                if backend is not None:
+                    backend.set(key, data, self.search_cache_timeout)
+        except (ValueError, ValidationError):
+            return JsonResponse(data={'error': 'invalid after'}, status=400)
+        return JsonResponse(data=data)
+
+
+class PopupExportView(PopupMetricsMixin, PopupLabelMixin, PermissionRequiredMixin, View):
+    """
+    Stream every choice ordered by pk, read with iterator(chunk_size), as ndjson (one {"id": ..., "value": ...}
+    per line, the default) or as a json list with ?format=json. Memory stays flat whatever the size of the table.
+    """
+    popup_action = 'export'
+    model = None
+    chunk_size = 2000
+    formats = {'ndjson': 'application/x-ndjson', 'json': 'application/json'}
+    http_method_names = ['get']
+    to_field_name = None
+
+    def get_queryset(self):
+        if not self.model:
+            raise ImproperlyConfigured('model must be override in PopupExportView')
+        return self.shape_queryset(self.route(self.model._default_manager.all()),
+                                   only=(self.to_field_name,)).order_by('pk')
+
+    def iter_chunks(self):
+        """
+        Yield lists of json rows, chunk_size rows at a time
+        """
+        chunk = []
+        for obj in self.get_queryset().iterator(chunk_size=self.chunk_size):
+            chunk.append(json.dumps({'id': getattr(obj, self.to_field_name or 'pk'), 'value': self.get_label(obj)},
+                                    cls=DjangoJSONEncoder, ensure_ascii=False))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def iter_ndjson(self):
+        for chunk in self.iter_chunks():
+            yield '\n'.join(chunk) + '\n'
+
+    def iter_json(self):
+        yield '['
+        separator = ''
+        for chunk in self.iter_chunks():
+            yield separator + ','.join(chunk)
+            separator = ','
+        yield ']'
+
+    def get(self, request, *args, **kwargs):
+        try:
+            self.to_field_name = self.get_to_field_name()
+        except ValueError as e:
+            return JsonResponse(data={'error': str(e)}, status=400)
+        export_format = request.GET.get('format', 'ndjson')
+        if export_format not in self.formats:
+            return JsonResponse(data={'error': 'format must be one of {}'.format(', '.join(self.formats))},
+                                status=400)
+        content = self.iter_ndjson() if export_format == 'ndjson' else self.iter_json()
+        response = StreamingHttpResponse(content, content_type=self.formats[export_format])
+        # let proxies pass the chunks as soon as they come
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class PopupChangesView(PopupMetricsMixin, PermissionRequiredMixin, View):
+    """
+    Return the changes of the change log after the token `since` as json,
+    {"token": ..., "changes": [{"op": ..., "id": ..., "value": ...}], "reset": false}.
+    reset is true when the log can't tell every change, the client must reload its choices.
+    """
+    popup_action = 'changes'
+    change_log_name = None
+    max_changes = 100
+    http_method_names = ['get']
+
+    def get(self, request, *args, **kwargs):
+        if not self.change_log_name:
+            raise ImproperlyConfigured('change_log_name must be override in PopupChangesView')
+
+        since = request.GET.get('since', '')
+        if not since:
+            return JsonResponse(data={'token': cache.get_change_token(self.change_log_name), 'changes': [],
+                                      'reset': False})
+        try:
+            since = int(since)
+        except ValueError:
+            return JsonResponse(data={'error': 'invalid since'}, status=400)
+        token, changes, complete = cache.get_changes(self.change_log_name, since, self.max_changes)
+        return JsonResponse(data={'token': token, 'changes': changes, 'reset': not complete})
+
+
+# every PopupCRUDViewSet subclass with a model, built and checked at startup
+registry = []
+
+
 class PopupCRUDViewSet(object):
     model = None
     form_class = None
@@ -77,6 +948,8 @@ class PopupCRUDViewSet(object):
     context_for_update = {}
     # parent class for PopupCreateView、PopupUpdateView、PopupDeleteView
     parent_class = object
+    # serve create、update and delete with async views, requires django>=4.2
+    async_views = False
     """
     permissions_required = {
         'create': ('post.add_category',),
@@ -86,6 +959,86 @@ class PopupCRUDViewSet(object):
     """
     raise_exception = True
     permissions_required = {}
+    # response after create and update, 'template' renders popup/success.html,
+    # 'message' returns a tiny page which posts the result to the runtime of the parent page
+    completion_mode = None
+    # fields searched by the choices view with icontains
+    search_fields = ()
+    # class or dotted path of the search backend, default is POPUP_SEARCH_BACKEND or ORMSearchBackend
+    search_backend = None
+    # cache the pages of the choices view for search_cache_timeout seconds in the cache of cache_alias,
+    # invalidated like cache_choices
+    search_cache = False
+    search_cache_timeout = 60
+    # database of the choices, searches and labels of widgets and views, default is the router
+    read_db = None
+    # database of saves and deletes, default is the router
+    write_db = None
+    # seconds a client reads from the write database after a write, when read_db is set
+    read_your_writes = 10
+    # form field filled by each pasted line in bulk create, default is the first field of form_class
+    bulk_field = None
+    bulk_max_rows = 100
+    # fetch only fast_delete_fields and label_only for the response and delete with one DELETE query when
+    # the collector has nothing to visit, only for models without delete() side effects
+    fast_delete = False
+    fast_delete_fields = ()
+    # query shaping used to load choices and to build labels of responses, e.g. for a __str__ using parent:
+    # label_select_related = ('parent',) and label_only = ('name', 'parent__name')
+    label_select_related = ()
+    label_prefetch_related = ()
+    label_only = ()
+    # function of the instance returning its label, default is __str__
+    label_from_instance = None
+    # cache the choices rendered by the widgets in the django cache, invalidated by a version of the model
+    # bumped by post_save、post_delete and the popup views
+    cache_choices = False
+    cache_timeout = 300
+    # cache of the choices, default is POPUP_CACHE_ALIAS or 'default'
+    cache_alias = None
+    # log the changes made by the popup views, widgets poll the changes view to stay current
+    change_log = False
+    # seconds an entry of the change log is kept
+    change_log_timeout = 3600
+    # milliseconds between two polls of the widgets
+    change_log_poll = 5000
+    # widgets of a request render the options once as json, each select gets them from the runtime,
+    # needs the request passed to the widgets
+    shared_choices = False
+    # load create and update forms with fetch into an inline layer, the iframe stays the fallback
+    fragment = False
+    # template of the form rendered in fragment mode, default is popup/fragment.html
+    template_name_fragment = None
+    # prefetch the create or update popup when the pointer rests on or the keyboard focuses its button,
+    # the click reuses it within preload_max_age seconds
+    preload = False
+    preload_max_age = 10
+    # widgets build their markup in python, byte for byte the one of the templates, see popup_field.render
+    fast_render = False
+    # ETag and Last-Modified for GET of create and update views, 304 when they match
+    conditional_get = False
+    # validators of the update view: a version field bumped by every change and/or a datetime field
+    version_field = None
+    last_modified_field = None
+    # keep the rendered create page in the cache of cache_alias for cache_timeout
+    cache_create_page = False
+    # page size of the choices view
+    paginate_by = 20
+    # widgets render the selected options and the runtime streams the others from the export view
+    stream_choices = False
+    # rows read from the database at a time by the export view
+    export_chunk_size = 2000
+    # ForeignKeyWidget and ManyToManyWidget load choices from the choices view
+    remote_choices = False
+    # ForeignKeyWidget and ManyToManyWidget render only the selected options
+    selected_only = False
+    # views generated by urls()
+    actions = ('create', 'update', 'delete', 'choices', 'bulk_create', 'bulk_delete', 'changes', 'export')
+
+    def __init_subclass__(cls, **kwargs):
+        super(PopupCRUDViewSet, cls).__init_subclass__(**kwargs)
+        if cls.model is not None:
+            registry.append(cls)
 
     @classonlymethod
     def get_template_name_create(cls):
@@ -111,6 +1064,115 @@ class PopupCRUDViewSet(object):
         else:
             return cls.template_name_update
 
+    @classonlymethod
+    def get_template_name_fragment(cls):
+        return cls.template_name_fragment or PopupFragmentMixin.template_name_fragment
+
+    @classonlymethod
+    def get_completion_mode(cls):
+        completion_mode = cls.completion_mode
+        if completion_mode is None:
+            completion_mode = getattr(settings, 'POPUP_COMPLETION_MODE', 'template')
+        if completion_mode not in COMPLETION_MODES:
+            raise ImproperlyConfigured('completion_mode must be one of {}'.format(', '.join(COMPLETION_MODES)))
+        return completion_mode
+
+    @classonlymethod
+    def shapes_labels(cls):
+        return bool(cls.label_select_related or cls.label_prefetch_related or cls.label_only or
+                    cls.label_from_instance is not None)
+
+    @classonlymethod
+    def get_label_queryset(cls, queryset, only=()):
+        """
+        Apply label_select_related、label_prefetch_related and label_only to queryset
+        """
+        if cls.label_select_related:
+            queryset = queryset.select_related(*cls.label_select_related)
+        if cls.label_prefetch_related:
+            queryset = queryset.prefetch_related(*cls.label_prefetch_related)
+        if cls.label_only:
+            queryset = queryset.only('pk', *[field for field in tuple(cls.label_only) + tuple(only) if field])
+        return queryset
+
+    @classonlymethod
+    def get_label(cls, obj):
+        if cls.label_from_instance is not None:
+            return cls.label_from_instance(obj)
+        return obj.__str__()
+
+    @classonlymethod
+    def get_choices_cache_key(cls, queryset, to_field_name=None, label_name=None):
+        """
+        Return the cache key of the choices of queryset with the labels of label_name, None if it can't be cached
+        """
+        try:
+            sql = str(queryset.query)
+        except EmptyResultSet:
+            return None
+        digest = hashlib.sha256('{}|{}|{}'.format(sql, to_field_name, label_name).encode('utf-8')).hexdigest()[:32]
+        return 'popup_field:choices:{}:{}:{}'.format(
+            cls.get_class_name(), cache.get_version(queryset.model), digest)
+
+    @classonlymethod
+    def get_read_db(cls, request=None):
+        """
+        Return the database of reads for request, the write database just after a write of its client
+        """
+        if cls.read_db is None:
+            return None
+        if request is not None and cls.get_written_cookie_name() in getattr(request, 'COOKIES', {}):
+            return cls.write_db or router.db_for_write(cls.model)
+        return cls.read_db
+
+    @classonlymethod
+    def get_written_cookie_name(cls):
+        return 'popup_written_{}'.format(cls.get_class_name())
+
+    @classonlymethod
+    def get_search_backend(cls):
+        """
+        Return the search backend instance of the viewset, built once
+        """
+        backend = cls.__dict__.get('_search_backend')
+        if backend is None:
+            backend_class = cls.search_backend or getattr(settings, 'POPUP_SEARCH_BACKEND',
+                                                          'popup_field.search.ORMSearchBackend')
+            if isinstance(backend_class, str):
+                backend_class = import_string(backend_class)
+            backend = backend_class(cls)
+            cls._search_backend = backend
+        return backend
+
+    @classonlymethod
+    def get_watched_models(cls):
+        """
+        Return the models whose version must follow every save and delete
+        """
+        models = []
+        if cls.cache_choices or cls.search_cache:
+            models.append(cls.model)
+        if cls.conditional_get and cls.form_class is not None:
+            for field in cls.form_class.base_fields.values():
+                queryset = getattr(field, 'queryset', None)
+                if queryset is not None and queryset.model not in models:
+                    models.append(queryset.model)
+        return models
+
+    @classonlymethod
+    def get_base_view(cls, view_class, async_view_class):
+        """
+        Return async_view_class when async_views is set
+        """
+        if not cls.async_views:
+            return view_class
+        if django.VERSION < (4, 2):
+            raise ImproperlyConfigured('async_views of {} requires django>=4.2'.format(cls.__name__))
+        if getattr(cls.parent_class, 'dispatch', View.dispatch) is not View.dispatch:
+            raise ImproperlyConfigured('parent_class of {} overrides dispatch, which async views can not call, '
+                                       'override has_permission instead'.format(cls.__name__))
+        return async_view_class
+
     @classonlymethod
     def get_class_name(cls):
         if cls.class_name is None:
@@ -126,18 +1188,28 @@ class PopupCRUDViewSet(object):
             return cls.class_verbose_name
 
     @classonlymethod
+    @cached_view
     def create(cls):
         """
         Returns the create view that can be specified as the second argument
         to url() in urls.py.
         """
 
-        class NewPopupCreateView(PopupCreateView, cls.parent_class):
+        class NewPopupCreateView(cls.get_base_view(PopupCreateView, AsyncPopupCreateView), cls.parent_class):
             model = cls.model
+            viewset_name = cls.__name__
+            viewset = cls
             form_class = cls.form_class
             popup_name = cls.get_class_verbose_name()
             template_name = cls.get_template_name_create()
+            template_name_fragment = cls.get_template_name_fragment()
             permission_required = cls.get_permission_required('create')
+            completion_mode = cls.get_completion_mode()
+            conditional_get = cls.conditional_get
+            cache_page = cls.cache_create_page
+            cache_alias = cls.cache_alias
+            cache_timeout = cls.cache_timeout
+            preload_max_age = cls.preload_max_age
 
             def get_context_data(self, **kwargs):
                 kwargs.update(cls.context_for_all)
@@ -151,18 +1223,27 @@ class PopupCRUDViewSet(object):
         return kwargs
 
     @classonlymethod
+    @cached_view
     def update(cls):
         """
         Returns the update view that can be specified as the second argument
         to url() in urls.py.
         """
 
-        class NewPopupUpdateView(PopupUpdateView, cls.parent_class):
+        class NewPopupUpdateView(cls.get_base_view(PopupUpdateView, AsyncPopupUpdateView), cls.parent_class):
             model = cls.model
+            viewset_name = cls.__name__
+            viewset = cls
             form_class = cls.form_class
             popup_name = cls.get_class_verbose_name()
             template_name = cls.get_template_name_update()
+            template_name_fragment = cls.get_template_name_fragment()
             permission_required = cls.get_permission_required('update')
+            completion_mode = cls.get_completion_mode()
+            conditional_get = cls.conditional_get
+            version_field = cls.version_field
+            last_modified_field = cls.last_modified_field
+            preload_max_age = cls.preload_max_age
 
             def get_context_data(self, **kwargs):
                 kwargs.update(cls.context_for_all)
@@ -172,37 +1253,174 @@ class PopupCRUDViewSet(object):
         return NewPopupUpdateView
 
     @classonlymethod
+    @cached_view
     def delete(cls):
         """
         Returns the delete view that can be specified as the second argument
         to url() in urls.py.
         """
 
-        class PopupDeleteViewView(PopupDeleteView, cls.parent_class):
+        class PopupDeleteViewView(cls.get_base_view(PopupDeleteView, AsyncPopupDeleteView), cls.parent_class):
             model = cls.model
+            viewset_name = cls.__name__
+            viewset = cls
             form_class = cls.form_class
+            fast_delete = cls.fast_delete
+            fast_delete_fields = cls.fast_delete_fields
             permission_required = cls.get_permission_required('delete')
 
         return PopupDeleteViewView
 
     @classonlymethod
-    def urls(cls):
+    @cached_view
+    def bulk_delete(cls):
+        """
+        Returns the bulk delete view that can be specified as the second argument
+        to url() in urls.py.
+        """
+
+        class NewPopupBulkDeleteView(PopupBulkDeleteView, cls.parent_class):
+            model = cls.model
+            viewset_name = cls.__name__
+            viewset = cls
+            fast_delete = cls.fast_delete
+            fast_delete_fields = cls.fast_delete_fields
+            bulk_max_rows = cls.bulk_max_rows
+            permission_required = cls.get_permission_required('delete')
+
+        return NewPopupBulkDeleteView
+
+    @classonlymethod
+    @cached_view
+    def bulk_create(cls):
+        """
+        Returns the bulk create view that can be specified as the second argument
+        to url() in urls.py.
+        """
+
+        class NewPopupBulkCreateView(PopupBulkCreateView, cls.parent_class):
+            model = cls.model
+            viewset_name = cls.__name__
+            viewset = cls
+            form_class = cls.form_class
+            bulk_field = cls.bulk_field
+            bulk_max_rows = cls.bulk_max_rows
+            permission_required = cls.get_permission_required('create')
+
+        return NewPopupBulkCreateView
+
+    @classonlymethod
+    @cached_view
+    def choices(cls):
+        """
+        Returns the choices view that can be specified as the second argument
+        to url() in urls.py.
+        """
+
+        class NewPopupChoicesView(PopupChoicesView, cls.parent_class):
+            model = cls.model
+            viewset_name = cls.__name__
+            viewset = cls
+            search_fields = cls.search_fields
+            paginate_by = cls.paginate_by
+            permission_required = cls.get_permission_required('view')
+            search_cache = cls.search_cache
+            search_cache_timeout = cls.search_cache_timeout
+            cache_alias = cls.cache_alias
+
+        return NewPopupChoicesView
+
+    @classonlymethod
+    @cached_view
+    def changes(cls):
         """
-        generate url and url_name for create、update and delete view
-        default url_name is classname_name
+        Returns the changes view that can be specified as the second argument
+        to url() in urls.py.
+        """
+
+        class NewPopupChangesView(PopupChangesView, cls.parent_class):
+            viewset_name = cls.__name__
+            change_log_name = cls.get_class_name()
+            permission_required = cls.get_permission_required('view')
+
+        return NewPopupChangesView
+
+    @classonlymethod
+    @cached_view
+    def export(cls):
+        """
+        Returns the export view that can be specified as the second argument
+        to url() in urls.py.
+        """
+
+        class NewPopupExportView(PopupExportView, cls.parent_class):
+            model = cls.model
+            viewset_name = cls.__name__
+            viewset = cls
+            chunk_size = cls.export_chunk_size
+            permission_required = cls.get_permission_required('view')
+
+        return NewPopupExportView
+
+    @classonlymethod
+    def get_view(cls, action):
+        """
+        Return the cached view function of action, built by as_view() once
+        """
+        views = cls.__dict__.get('_views')
+        if views is None:
+            views = {}
+            cls._views = views
+        if action not in views:
+            views[action] = getattr(cls, action)().as_view()
+        return views[action]
+
+    @classonlymethod
+    def build_views(cls):
+        """
+        Build every view of the viewset, raise ImproperlyConfigured for a bad configuration
+        """
+        return [cls.get_view(action) for action in cls.actions]
+
+    @classonlymethod
+    def reset_views(cls):
+        """
+        Drop the cached views, they are built again with the current attributes at next use
+        """
+        cls.__dict__.get('_view_classes', {}).clear()
+        cls.__dict__.get('_views', {}).clear()
+        if '_search_backend' in cls.__dict__:
+            del cls._search_backend
+
+    @classonlymethod
+    def urls(cls, decorator=None):
+        """
+        generate url and url_name for create、update、delete、choices、bulk create、bulk delete、changes and export view
+        default url_name is classname_name, decorator wraps every view, e.g. admin_view of an admin site
         """
         class_name = cls.get_class_name()
+        view = cls.get_view if decorator is None else lambda action: decorator(cls.get_view(action))
         if django.VERSION >= (2, 0):
             return path('{}/'.format(class_name), include([
-                path('popup/', cls.create().as_view(), name='{}_popup_create'.format(class_name)),
-                path('popup/<int:pk>/', cls.update().as_view(), name='{}_popup_update'.format(class_name)),
-                path('popup/delete/<int:pk>/', cls.delete().as_view(), name='{}_popup_delete'.format(class_name)),
+                path('popup/', view('create'), name='{}_popup_create'.format(class_name)),
+                path('popup/<int:pk>/', view('update'), name='{}_popup_update'.format(class_name)),
+                path('popup/delete/<int:pk>/', view('delete'), name='{}_popup_delete'.format(class_name)),
+                path('popup/choices/', view('choices'), name='{}_popup_choices'.format(class_name)),
+                path('popup/bulk/', view('bulk_create'), name='{}_popup_bulk_create'.format(class_name)),
+                path('popup/delete/bulk/', view('bulk_delete'), name='{}_popup_bulk_delete'.format(class_name)),
+                path('popup/changes/', view('changes'), name='{}_popup_changes'.format(class_name)),
+                path('popup/export/', view('export'), name='{}_popup_export'.format(class_name)),
             ]))
         else:
             return url(r'^{}/'.format(class_name), include([
-                url(r'^popup/$', cls.create().as_view(), name='{}_popup_create'.format(class_name)),
-                url(r'^popup/(?P<pk>\d+)/$', cls.update().as_view(), name='{}_popup_update'.format(class_name)),
-                url(r'^popup/delete/(?P<pk>\d+)/$', cls.delete().as_view(), name='{}_popup_delete'.format(class_name)),
+                url(r'^popup/$', view('create'), name='{}_popup_create'.format(class_name)),
+                url(r'^popup/(?P<pk>\d+)/$', view('update'), name='{}_popup_update'.format(class_name)),
+                url(r'^popup/delete/(?P<pk>\d+)/$', view('delete'), name='{}_popup_delete'.format(class_name)),
+                url(r'^popup/choices/$', view('choices'), name='{}_popup_choices'.format(class_name)),
+                url(r'^popup/bulk/$', view('bulk_create'), name='{}_popup_bulk_create'.format(class_name)),
+                url(r'^popup/delete/bulk/$', view('bulk_delete'), name='{}_popup_bulk_delete'.format(class_name)),
+                url(r'^popup/changes/$', view('changes'), name='{}_popup_changes'.format(class_name)),
+                url(r'^popup/export/$', view('export'), name='{}_popup_export'.format(class_name)),
             ]))
 
     @classonlymethod
@@ -211,10 +1429,18 @@ class PopupCRUDViewSet(object):
         generate fk field related to class wait popup crud
         """
         kwargs['popup_name'] = cls.get_class_verbose_name()
-        kwargs['permissions_required'] = cls.permissions_required
+        kwargs.setdefault('permissions_required', cls.permissions_required)
+        kwargs['viewset'] = cls
+        kwargs.setdefault('remote', cls.remote_choices)
+        kwargs.setdefault('selected_only', cls.selected_only)
+        kwargs.setdefault('fragment', cls.fragment)
+        kwargs.setdefault('shared_choices', cls.shared_choices)
+        kwargs.setdefault('stream', cls.stream_choices)
+        kwargs.setdefault('preload', cls.preload)
+        kwargs.setdefault('fast_render', cls.fast_render)
         if cls.template_name_fk is not None:
             kwargs['template_name'] = cls.template_name_fk
-        return ForeignKeyWidget('{}_popup_create'.format(cls.get_class_name()), *args, **kwargs)
+        return ForeignKeyWidget(cls.get_url_name(kwargs.pop('namespace', None)), *args, **kwargs)
 
     @classonlymethod
     def get_m2m_popup_field(cls, *args, **kwargs):
@@ -222,15 +1448,36 @@ class PopupCRUDViewSet(object):
         generate m2m field related to class wait popup crud
         """
         kwargs['popup_name'] = cls.get_class_verbose_name()
-        kwargs['permissions_required'] = cls.permissions_required
+        kwargs.setdefault('permissions_required', cls.permissions_required)
+        kwargs['viewset'] = cls
+        kwargs.setdefault('remote', cls.remote_choices)
+        kwargs.setdefault('selected_only', cls.selected_only)
+        kwargs.setdefault('fragment', cls.fragment)
+        kwargs.setdefault('shared_choices', cls.shared_choices)
+        kwargs.setdefault('stream', cls.stream_choices)
+        kwargs.setdefault('preload', cls.preload)
+        kwargs.setdefault('fast_render', cls.fast_render)
         if cls.template_name_m2m is not None:
             kwargs['template_name'] = cls.template_name_m2m
-        return ManyToManyWidget('{}_popup_create'.format(cls.get_class_name()), *args, **kwargs)
+        return ManyToManyWidget(cls.get_url_name(kwargs.pop('namespace', None)), *args, **kwargs)
+
+    @classonlymethod
+    def get_url_name(cls, namespace=None):
+        """
+        Return the url name of the create view, the widgets derive the other urls from it
+        """
+        name = '{}_popup_create'.format(cls.get_class_name())
+        return '{}:{}'.format(namespace, name) if namespace else name
 
     @classonlymethod
     def get_permission_required(cls, action):
         """
         Return the permission required for the CRUD operation specified in action.
-        Default implementation returns the value of one
+        Default implementation returns the value of one, the view permission of the model for 'view'
         """
+        if action == 'view' and action not in cls.permissions_required:
+            # choices、export and changes list every row of the model
+            opts = cls.model._meta
+            codename = get_permission_codename('view' if django.VERSION >= (2, 1) else 'change', opts)
+            return ['{}.{}'.format(opts.app_label, codename)]
         return cls.permissions_required.get(action, [])
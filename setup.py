@@ -20,9 +20,7 @@ setup(
     description='A popup field for django which can create\\update\\delete ForeignKey and ManyToManyField instance by popup windows.',
     long_description=README + '\n\n' + HISTORY,
     license='BSD 3-Clause License',
-    packages=[
-        'popup_field'
-    ],
+    packages=find_packages(exclude=['demo*']),
     include_package_data=True,
     install_requires=[
     ],